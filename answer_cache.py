@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+ANSWER_CACHE_FILENAME = "answer_cache.db"
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 30 * 24 * 60 * 60
+
+
+def normalize_prompt(prompt):
+    """
+    Normalizes a prompt so that answers are shared across trivial differences.
+
+    Parameters:
+    - prompt (str): The prompt as asked.
+
+    Returns:
+    - str: The prompt in lowercase with collapsed whitespace.
+    """
+    return " ".join(prompt.lower().split())
+
+
+def answer_key(song_id, prompt, model_name, lyrics, retrieval_mode, embedding_model=None):
+    """
+    Builds the cache key of an answer.
+
+    Parameters:
+    - song_id (str): The Spotify ID of the song.
+    - prompt (str): The prompt that was asked.
+    - model_name (str): The name of the chat model.
+    - lyrics (str): The lyrics the model answers from.
+    - retrieval_mode (str): "direct" if the lyrics are given to the model
+      whole, "vectorstore" if their chunks are retrieved.
+    - embedding_model (str): The model the chunks and prompt are embedded
+      with when retrieving. With the lyrics and the prompt, these decide the
+      context of the answer, so no retrieval is needed to build the key.
+
+    Returns:
+    - str: A hex digest that changes whenever any of the inputs change.
+    """
+    lyrics_hash = hashlib.sha256(lyrics.encode("utf-8")).hexdigest()
+    key = "\0".join([song_id, normalize_prompt(prompt), model_name, lyrics_hash,
+                     retrieval_mode, embedding_model or ""])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    A two-tier cache of LLM answers with a time to live: a bounded in-memory
+    LRU in front of a SQLite table shared by all processes.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_FILENAME, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT, expires REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_expires ON answers (expires)")
+
+    def get(self, key):
+        """
+        Returns a cached answer.
+
+        Parameters:
+        - key (str): The key from answer_key().
+
+        Returns:
+        - str or None: The answer, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                return entry[0]
+
+            row = self._conn.execute(
+                "SELECT answer, expires FROM answers WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self._memory.pop(key, None)
+                return None
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def set(self, key, answer):
+        """
+        Stores an answer in both tiers, deleting the expired answers from
+        the shared table.
+
+        Parameters:
+        - key (str): The key from answer_key().
+        - answer (str): The answer of the model.
+        """
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?)", (key, answer, expires)
+                )
+            self._remember(key, answer, expires)
+
+    def _remember(self, key, answer, expires):
+        self._memory[key] = (answer, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+
+def prewarm(data_path, limit=None):
+    """
+    Answers every predefined prompt of every song in a dataset ahead of time,
+    so the first user to ask one gets the cached answer. Prompts that are
+    already cached are not sent to the model again.
+
+    Parameters:
+    - data_path (str): The data.json or data.parquet of the app.
+    - limit (int): Only pre-warm the first songs of the dataset.
+
+    Returns:
+    - int: The number of prompts answered.
+    """
+    from dotenv import load_dotenv
+
+    import app_function as app
+    import choosingdata
+
+    load_dotenv()
+    dataset = choosingdata.get_dataset(data_path)
+    df = dataset.df if limit is None else dataset.df.head(limit)
+
+    answered = 0
+    start = time.time()
+    for i in range(len(df)):
+        row = df.iloc[i]
+        try:
+            lyrics = dataset.get_lyrics(row)
+            retriever = app.get_song_retriever(row["id"], lyrics)
+            for prompt in app.predefined_prompts(row["title"], row["artist"]):
+                # A fresh chain per prompt, as every predefined prompt opens a chat
+                conversation = app.get_conversation_chain(retriever)
+                app.answer_question(conversation, row["id"], lyrics, prompt, cacheable=True)
+                answered += 1
+        except Exception as error:
+            print(f"Failed: {row['title']} by {row['artist']} ({error})")
+    print(f"Pre-warmed {answered} prompts of {len(df)} songs in {time.time() - start:.1f}s")
+    return answered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-warm the answers to the predefined prompts.")
+    parser.add_argument("data", nargs="?", default=None, help="data.json or data.parquet (default: the app's data file)")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.data is None:
+        from app_function import get_data_file
+
+        args.data = get_data_file()
+    prewarm(args.data, args.limit)
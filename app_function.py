@@ -1,32 +1,46 @@
+import os
+import queue
+import threading
 import streamlit as st
-from streamlit_js_eval import streamlit_js_eval
-import choosingdata as choice
+import metrics
+from vector_cache import VectorStoreCache
+from answer_cache import AnswerCache, answer_key
+from text_chunks import get_text_chunks
 from dotenv import load_dotenv
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceInstructEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain_community.llms import HuggingFaceHub
 
+# The recommender, LangChain, OpenAI and FAISS are imported on first use, so
+# the page and sidebar render before any of them is loaded.
+# Run startup_report.py to see what importing this module costs.
 
-def get_text_chunks(text):
-    """
-    Splits the given text into chunks based on specified character settings.
+CATALOG_FILE = "data.parquet"
+JSON_FILE = "data.json"
+MODEL_NAME = "gpt-4-1106-preview"
+# Older turns are dropped from the prompt once the chat history exceeds this many tokens
+MEMORY_TOKEN_LIMIT = int(os.getenv("MEMORY_TOKEN_LIMIT", "2000"))
+# Lyrics up to this many tokens go into the prompt whole instead of being retrieved
+DIRECT_CONTEXT_TOKENS = int(os.getenv("DIRECT_CONTEXT_TOKENS", "1500"))
 
-    Parameters:
-    - text (str): The text to be split into chunks.
+vector_cache = VectorStoreCache()
+answer_cache = AnswerCache()
+corpus_index = None
+corpus_index_loaded = False
+corpus_index_lock = threading.Lock()
+
+
+def get_data_file():
+    """
+    Returns the data file to read: the columnar catalog, which keeps lyrics out
+    of memory until a song is picked, unless data.json was written after it,
+    e.g. by recompute_features.py.
 
     Returns:
-    - list: A list of text chunks.
+    - str: The path of the data file.
     """
-    text_splitter = CharacterTextSplitter(
-        separator="\n", chunk_size=1000, chunk_overlap=200, length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    return chunks
+    if not os.path.exists(CATALOG_FILE):
+        return JSON_FILE
+    if os.path.exists(JSON_FILE) and os.path.getmtime(JSON_FILE) > os.path.getmtime(CATALOG_FILE):
+        return JSON_FILE
+    return CATALOG_FILE
 
 
 def get_vectorstore(text_chunks):
@@ -39,33 +53,286 @@ def get_vectorstore(text_chunks):
     Returns:
     - FAISS: A FAISS vector store containing the embeddings of the text chunks.
     """
-    embeddings = OpenAIEmbeddings()
-    vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
+    from corpus_index import get_embeddings
+    from langchain_community.vectorstores import FAISS
+
+    embeddings = get_embeddings(os.getenv("EMBEDDER", "openai"))
+    with metrics.span("chat.embed", chunks=len(text_chunks)):
+        vectors = embeddings.embed_documents(text_chunks)
+    with metrics.span("chat.faiss_build"):
+        vectorstore = FAISS.from_embeddings(zip(text_chunks, vectors), embeddings)
     return vectorstore
 
 
-def get_conversation_chain(vectorstore):
+def get_corpus_index():
+    """
+    Loads the prebuilt corpus index on first use.
+
+    Returns:
+    - CorpusIndex or None: The corpus index, or None if it has not been built.
+    """
+    global corpus_index, corpus_index_loaded
+
+    with corpus_index_lock:
+        if not corpus_index_loaded:
+            from corpus_index import CorpusIndex
+
+            corpus_index = CorpusIndex.load()
+            corpus_index_loaded = True
+    return corpus_index
+
+
+def get_song_vectorstore(song_id, lyrics):
+    """
+    Returns the vector store of a song. Songs in the prebuilt corpus index are
+    served from its stored vectors; any other song comes from the shared cache,
+    embedding the lyrics only if no session or earlier process has done so already.
+
+    Parameters:
+    - song_id (str): The Spotify ID of the song.
+    - lyrics (str): The lyrics of the song.
+
+    Returns:
+    - FAISS: A FAISS vector store containing the embeddings of the lyrics.
+    """
+    from corpus_index import get_embeddings
+
+    index = get_corpus_index()
+    if index is not None and index.has(song_id, lyrics):
+        metrics.increment("corpus_index.hits")
+        return index.vectorstore(song_id)
+
+    embeddings = get_embeddings(os.getenv("EMBEDDER", "openai"))
+    return vector_cache.get(
+        song_id,
+        lyrics,
+        embeddings.model,
+        embeddings,
+        lambda: get_vectorstore(get_text_chunks(lyrics)),
+    )
+
+
+def get_model_name():
+    """
+    Returns the name of the chat model selected with the LLM environment variable.
+
+    Returns:
+    - str: "stub" for the offline stub model, otherwise the OpenAI model name.
+    """
+    return "stub" if os.getenv("LLM", "openai") == "stub" else MODEL_NAME
+
+
+def get_llm(streaming=False):
+    """
+    Initializes the chat model. Setting the LLM environment variable to "stub"
+    selects an offline stub model whose latency is set with
+    STUB_LLM_FIRST_TOKEN_DELAY and STUB_LLM_TOKEN_DELAY (in seconds).
+
+    Parameters:
+    - streaming (bool): Whether the model reports every token as it is generated.
+
+    Returns:
+    - BaseChatModel: The chat model.
+    """
+    if get_model_name() == "stub":
+        from stub_llm import StubChatModel
+
+        return StubChatModel(
+            streaming=streaming,
+            first_token_delay=float(os.getenv("STUB_LLM_FIRST_TOKEN_DELAY", "0.5")),
+            token_delay=float(os.getenv("STUB_LLM_TOKEN_DELAY", "0.02")),
+        )
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model_name=MODEL_NAME, streaming=streaming)
+
+
+def get_retrieval_mode(song_id, lyrics):
+    """
+    Returns how get_song_retriever() gives the lyrics of a song to the model,
+    without building the retriever.
+
+    Parameters:
+    - song_id (str): The Spotify ID of the song.
+    - lyrics (str): The lyrics of the song.
+
+    Returns:
+    - tuple: "direct" or "vectorstore", and the name of the embedding model
+      the chunks are retrieved with, or None for direct context.
+    """
+    from corpus_index import get_embeddings
+
+    if get_llm().get_num_tokens(lyrics) <= DIRECT_CONTEXT_TOKENS:
+        return "direct", None
+    index = get_corpus_index()
+    if index is not None and index.has(song_id, lyrics):
+        return "vectorstore", index.manifest["model"]
+    return "vectorstore", get_embeddings(os.getenv("EMBEDDER", "openai")).model
+
+
+def get_song_retriever(song_id, lyrics):
+    """
+    Returns the retriever of a song. Lyrics that fit DIRECT_CONTEXT_TOKENS are
+    given to the model whole, skipping chunking, embedding and retrieval; only
+    longer lyrics are searched through their vector store.
+
+    Parameters:
+    - song_id (str): The Spotify ID of the song.
+    - lyrics (str): The lyrics of the song.
+
+    Returns:
+    - BaseRetriever: The retriever of the lyrics.
+    """
+    from chat_components import StaticRetriever
+    from langchain_core.documents import Document
+
+    if get_llm().get_num_tokens(lyrics) <= DIRECT_CONTEXT_TOKENS:
+        metrics.increment("retriever.direct_context")
+        return StaticRetriever(documents=[Document(page_content=lyrics)])
+    metrics.increment("retriever.vectorstore")
+    return get_song_vectorstore(song_id, lyrics).as_retriever()
+
+
+def get_conversation_chain(retriever):
     """
     Initializes a conversational retrieval chain that uses a large language model
-    for generating responses based on the provided vector store.
+    for generating responses based on the provided retriever.
 
     Parameters:
-    - vectorstore (FAISS): A vector store to be used for retrieving relevant content.
+    - retriever (BaseRetriever): A retriever of the relevant content.
 
     Returns:
     - ConversationalRetrievalChain: An initialized conversational chain object.
     """
-    llm = ChatOpenAI(
-        model_name="gpt-4-1106-preview",
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.memory import ConversationTokenBufferMemory
+
+    # Only the answer is streamed; rephrasing follow-up questions stays silent
+    llm = get_llm(streaming=True)
+    condense_llm = get_llm()
+
+    memory = ConversationTokenBufferMemory(
+        llm=condense_llm,
+        max_token_limit=MEMORY_TOKEN_LIMIT,
+        memory_key="chat_history",
+        return_messages=True,
     )
-
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
     conversation_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm, retriever=vectorstore.as_retriever(), memory=memory
+        llm=llm,
+        retriever=retriever,
+        memory=memory,
+        condense_question_llm=condense_llm,
     )
     return conversation_chain
 
 
+def answer_question(conversation, song_id, lyrics, question, cacheable=False, callbacks=None):
+    """
+    Answers a question with the conversation chain. Cacheable questions are
+    answered from the shared answer cache when the same song, lyrics, question,
+    model and retrieval mode have been answered before, and stored after a
+    miss. A cache hit runs no retrieval at all.
+
+    Parameters:
+    - conversation (ConversationalRetrievalChain): The chain of the current song.
+    - song_id (str): The Spotify ID of the song.
+    - lyrics (str): The lyrics the chain answers from.
+    - question (str): The question of the user.
+    - cacheable (bool): Whether the answer only depends on the song and the
+      question, as for the predefined prompts asked at the start of a chat.
+    - callbacks (list): Callback handlers for the chain run.
+
+    Returns:
+    - str: The answer.
+    """
+    config = {"callbacks": callbacks}
+    if not cacheable:
+        return conversation.invoke({"question": question}, config)["answer"]
+
+    key = answer_key(song_id, question, get_model_name(), lyrics, *get_retrieval_mode(song_id, lyrics))
+
+    answer = answer_cache.get(key)
+    if answer is not None:
+        metrics.increment("answer_cache.hits")
+        conversation.memory.save_context({"question": question}, {"answer": answer})
+        return answer
+
+    metrics.increment("answer_cache.misses")
+    answer = conversation.invoke({"question": question}, config)["answer"]
+    answer_cache.set(key, answer)
+    return answer
+
+
+def stream_answer(conversation, song_id, lyrics, question, cacheable=False):
+    """
+    Answers a question like answer_question(), yielding the tokens of the
+    answer as the model generates them. The chain runs on a worker thread and
+    hands the tokens over through a queue; cached answers are yielded whole.
+
+    Parameters:
+    - conversation (ConversationalRetrievalChain): The chain of the current song.
+    - song_id (str): The Spotify ID of the song.
+    - lyrics (str): The lyrics the chain answers from.
+    - question (str): The question of the user.
+    - cacheable (bool): Whether the answer may come from the answer cache.
+
+    Yields:
+    - str: The next part of the answer.
+    """
+    from chat_components import MetricsCallbackHandler, TokenQueueHandler
+
+    tokens = queue.Queue()
+    result = {}
+
+    def run():
+        try:
+            with metrics.span("chat.turn", cacheable=cacheable):
+                result["answer"] = answer_question(
+                    conversation,
+                    song_id,
+                    lyrics,
+                    question,
+                    cacheable,
+                    [TokenQueueHandler(tokens), MetricsCallbackHandler()],
+                )
+        except Exception as error:
+            result["error"] = error
+        finally:
+            tokens.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    streamed = False
+    while (token := tokens.get()) is not None:
+        streamed = True
+        yield token
+    thread.join()
+
+    if "error" in result:
+        raise result["error"]
+    if not streamed:
+        yield result["answer"]
+
+
+def predefined_prompts(title, artist):
+    """
+    Returns the predefined prompts offered for a song.
+
+    Parameters:
+    - title (str): The title of the song.
+    - artist (str): The artist of the song.
+
+    Returns:
+    - list: The prompt texts.
+    """
+    return [
+        f"What is the meaning of the song {title} by {artist}?",
+        f"What is the most difficult English grammar point in the song {title} by {artist}? Can you explain it?",
+        f"What is the most common English word in the song {title} by {artist} (excluding stopwords)? Can you give some example sentences using that word?",
+        f"What is the most worth learning English phrase in the song {title} by {artist}? Can you explain it and provide practical example using the phrase?",
+    ]
+
+
 def set_prompt(text_block):
     """
     Callback function that sets the chosen prompt in the session state.
@@ -82,12 +349,9 @@ def prompts():
     Renders clickable buttons for predefined prompts in the Streamlit application,
     allowing the user to select a prompt to send to the conversation chain.
     """
-    potential_prompts = [
-        f"What is the meaning of the song {st.session_state['title']} by {st.session_state['artist']}?",
-        f"What is the most difficult English grammar point in the song {st.session_state['title']} by {st.session_state['artist']}? Can you explain it?",
-        f"What is the most common English word in the song {st.session_state['title']} by {st.session_state['artist']} (excluding stopwords)? Can you give some example sentences using that word?",
-        f"What is the most worth learning English phrase in the song {st.session_state['title']} by {st.session_state['artist']}? Can you explain it and provide practical example using the phrase?",
-    ]
+    potential_prompts = predefined_prompts(
+        st.session_state["title"], st.session_state["artist"]
+    )
     chosen_prompt = None
     for index, text_block in enumerate(potential_prompts):
         st.button(
@@ -118,6 +382,22 @@ def page_title():
         st.title("🎵 English Music Recommender 💬")
 
 
+def select_song(dataset, song):
+    """
+    Makes a song the one the user studies.
+
+    Parameters:
+    - dataset (PreparedDataset): The dataset the song comes from.
+    - song (Series): The row of the song in dataset.df.
+    """
+    st.session_state["title"] = song["title"]
+    st.session_state["artist"] = song["artist"]
+    st.session_state["lyrics"] = dataset.get_lyrics(song)
+    st.session_state["song_id"] = song["id"]
+    st.session_state["id"] = f'https://open.spotify.com/track/{song["id"]}'
+    st.session_state["song_bool"] = True
+
+
 def chat_sidebar():
     """
     Renders the sidebar in the Streamlit application for selecting music preferences
@@ -141,24 +421,34 @@ def chat_sidebar():
         if not st.session_state["song_bool"]:
 
             if st.sidebar.button("Submit"):
-                df = choice.process_data("data.json")
+                import choosingdata as choice
+
+                dataset = choice.get_dataset(get_data_file())
                 recommendations = choice.recommendation(
-                    df,
+                    dataset.df,
                     dance_choice=user_danceability,
                     valence_choice=user_valence,
                     difficulty_choice=user_difficulty,
+                    buckets=dataset.buckets,
                 )
 
-                st.session_state["title"] = recommendations["title"].values[0]
-                st.session_state["artist"] = recommendations["artist"].values[0]
-                st.session_state["lyrics"] = recommendations["lyrics"].values[0]
-                st.session_state["id"] = (
-                    f'https://open.spotify.com/track/{recommendations["id"].values[0]}'
-                )
-                st.session_state["song_bool"] = True
-
+                select_song(dataset, recommendations.iloc[0])
                 st.rerun()
 
+            st.write("#### Or find a song")
+            query = st.sidebar.text_input("Title or artist:")
+            if query:
+                import choosingdata as choice
+
+                dataset = choice.get_dataset(get_data_file())
+                matches = dataset.find_songs(query)
+                if matches.empty:
+                    st.write("No matching songs.")
+                for i, (_, song) in enumerate(matches.iterrows()):
+                    if st.sidebar.button(f"{song['title']} by {song['artist']}", key=f"found_{i}"):
+                        select_song(dataset, song)
+                        st.rerun()
+
         else:
             if st.session_state["song_bool"]:
 
@@ -169,8 +459,22 @@ def chat_sidebar():
                     f'<a href="{st.session_state["id"]}"><img src="{st.session_state["icon"]}" alt="Clickable image" style="height:60px;"></a>',
                     unsafe_allow_html=True,
                 )
+                import choosingdata as choice
+
+                similar = choice.get_dataset(get_data_file()).similar_songs(
+                    st.session_state["song_id"]
+                )
+                st.write("#### More like this")
+                st.markdown(
+                    "\n".join(
+                        f"- {song['title']} by {song['artist']}"
+                        for _, song in similar.iterrows()
+                    )
+                )
                 st.write("Please refresh the page for a new recommendation.")
                 if st.button("Reload page"):
+                    from streamlit_js_eval import streamlit_js_eval
+
                     streamlit_js_eval(js_expressions="parent.window.location.reload()")
 
 
@@ -181,9 +485,11 @@ def chat():
     """
     if st.session_state["lyrics"]:
 
-        text_chunks = get_text_chunks(get_lyrics())
-        vectorstore = get_vectorstore(text_chunks)
-        st.session_state.conversation = get_conversation_chain(vectorstore)
+        # The chain and its memory live as long as the session stays on this song
+        if st.session_state.conversation_song != st.session_state["song_id"]:
+            retriever = get_song_retriever(st.session_state["song_id"], get_lyrics())
+            st.session_state.conversation = get_conversation_chain(retriever)
+            st.session_state.conversation_song = st.session_state["song_id"]
 
         if len(st.session_state.messages) == 1:
             message = st.session_state.messages[0]
@@ -206,15 +512,27 @@ def chat():
         if st.session_state.messages[-1]["role"] != "system":
 
             with st.chat_message("system"):
-                with st.spinner("Generating response..."):
-                    response = st.session_state.conversation.invoke(
-                        {"question": st.session_state.prompts}
+                # Predefined prompts are only offered before the first answer
+                cacheable = len(
+                    st.session_state.messages
+                ) == 2 and st.session_state.prompts in predefined_prompts(
+                    st.session_state["title"], st.session_state["artist"]
+                )
+                answer = st.write_stream(
+                    stream_answer(
+                        st.session_state.conversation,
+                        st.session_state["song_id"],
+                        get_lyrics(),
+                        st.session_state.prompts,
+                        cacheable,
                     )
-                    st.session_state.chat_history = response["chat_history"]
-                    message = st.session_state.chat_history[-1]
-                    st.write(message.content)
-                    message = {"role": "system", "content": message.content}
-                    st.session_state.messages.append(message)
+                )
+                st.session_state.chat_history = (
+                    st.session_state.conversation.memory.chat_memory.messages
+                )
+                message = {"role": "system", "content": answer}
+                st.session_state.messages.append(message)
+                metrics.schedule_snapshot()
 
     else:
         st.write("You can chat with GPT once a song has been recommended to you!")
@@ -248,9 +566,13 @@ def init():
         ]
     if "conversation" not in st.session_state:
         st.session_state.conversation = None
+    if "conversation_song" not in st.session_state:
+        st.session_state.conversation_song = ""
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = None
     if "lyrics" not in st.session_state:
         st.session_state["lyrics"] = ""
+    if "song_id" not in st.session_state:
+        st.session_state["song_id"] = ""
     if "prompts" not in st.session_state:
         st.session_state["prompts"] = ""
@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import platform
+import string
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+SIZES = [1000, 100000, 1000000]
+# Distinct synthetic lyrics; songs share them so a 1M-song catalogue fits in memory
+LYRICS_POOL_SIZE = 1000
+# Lyrics per benchmark of the per-song stages, whose cost does not grow with the catalogue
+LYRICS_SAMPLE_SIZE = 200
+RECOMMENDATION_CALLS = 1000
+# Largest catalogue loaded from data.json; a 1M-song data.json is about 1.7 GB
+# and takes several times that to parse, so larger ones are only loaded from
+# the columnar catalog, as the app does
+JSON_MAX_SONGS = 100000
+SEARCH_CALLS = 1000
+
+# Mean and standard deviation of the features in data.json, with their valid range
+FEATURE_STATS = {
+    "danceability": (0.636, 0.144, 0.0, 1.0),
+    "valence": (0.436, 0.229, 0.0, 1.0),
+    "speechiness": (0.113, 0.111, 0.0, 1.0),
+    "fres": (93.5, 8.2, 0.0, 121.22),
+    "vocabComplex": (0.479, 0.093, 0.0, 1.0),
+    "sentenceLength": (154.3, 97.4, 1.0, 1000.0),
+    "avgSyllable": (2.39, 0.37, 0.5, 4.0),
+}
+
+
+def get_vocabulary(seed_path="data.json", size=5000):
+    """
+    Returns the words synthetic lyrics are made of: the most frequent words of
+    the real lyrics when data.json is present, or made-up words otherwise.
+
+    Parameters:
+    - seed_path (str): The data.json to take the words from.
+    - size (int): The number of words.
+
+    Returns:
+    - list: The words, most frequent first.
+    """
+    if os.path.exists(seed_path):
+        with open(seed_path, "r") as file:
+            songs = json.load(file)
+        words = pd.Series(" ".join(song["lyrics"] for song in songs).split()).value_counts()
+        return words.index[:size].tolist()
+
+    rng = np.random.default_rng(0)
+    letters = np.array(list(string.ascii_lowercase))
+    return ["".join(rng.choice(letters, rng.integers(2, 9))) for _ in range(size)]
+
+
+def generate_lyrics(rng, vocabulary):
+    """
+    Generates one synthetic lyric: verses and a repeated chorus of short lines,
+    with a word count drawn around the median of the real lyrics (about 190
+    words) and words drawn with a Zipf-like frequency.
+
+    Parameters:
+    - rng (Generator): The random generator.
+    - vocabulary (list of str): The words, most frequent first.
+
+    Returns:
+    - str: The lyric, one line per row.
+    """
+    n_words = int(np.clip(rng.lognormal(np.log(190), 0.45), 20, 1500))
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+
+    def stanza(words):
+        picked = rng.choice(len(vocabulary), words, p=weights)
+        lines, start = [], 0
+        while start < words:
+            length = int(rng.integers(4, 11))
+            lines.append(" ".join(vocabulary[i] for i in picked[start : start + length]).capitalize())
+            start += length
+        return "\n".join(lines)
+
+    chorus = stanza(max(n_words // 5, 8))
+    parts, words = [], 0
+    while words < n_words:
+        verse_words = max(n_words // 4, 8)
+        parts.extend([stanza(verse_words), chorus])
+        words += verse_words + max(n_words // 5, 8)
+    return "\n\n".join(parts)
+
+
+def generate_catalogue(n, seed=0, vocabulary=None, pool_size=LYRICS_POOL_SIZE):
+    """
+    Generates a synthetic catalogue in the data.json schema. Features follow
+    the distributions of data.json; lyrics are drawn from a pool of distinct
+    synthetic lyrics.
+
+    Parameters:
+    - n (int): The number of songs.
+    - seed (int): The seed of the generator.
+    - vocabulary (list of str): The words of the lyrics; defaults to get_vocabulary().
+    - pool_size (int): The number of distinct lyrics.
+
+    Returns:
+    - list: The songs as dicts.
+    """
+    rng = np.random.default_rng(seed)
+    if vocabulary is None:
+        vocabulary = get_vocabulary()
+    pool = [generate_lyrics(rng, vocabulary) for _ in range(min(pool_size, n))]
+
+    alphabet = np.array(list(string.ascii_letters + string.digits))
+    ids = ["".join(chars) for chars in rng.choice(alphabet, (n, 22))]
+    features = {
+        name: np.clip(rng.normal(mean, std, n), low, high)
+        for name, (mean, std, low, high) in FEATURE_STATS.items()
+    }
+    lyrics = rng.integers(0, len(pool), n)
+
+    return [
+        {
+            "id": ids[i],
+            "title": f"Song {i}",
+            "artist": f"Artist {i % 5000}",
+            **{name: float(values[i]) for name, values in features.items()},
+            "lyrics": pool[lyrics[i]],
+            "lang": "en",
+        }
+        for i in range(n)
+    ]
+
+
+def measure(function, repeat):
+    """
+    Times a function, then runs it once more under tracemalloc for its peak memory.
+
+    Parameters:
+    - function (callable): The code to measure, called without arguments.
+    - repeat (int): The number of timed calls.
+
+    Returns:
+    - dict: Latency percentiles in milliseconds and the peak memory in MB.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        "repeat": repeat,
+        "mean_ms": float(timings.mean()),
+        "min_ms": float(timings.min()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p90_ms": float(np.percentile(timings, 90)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "max_ms": float(timings.max()),
+        "peak_memory_mb": peak / 2**20,
+    }
+
+
+def run_benchmarks(sizes=SIZES, repeat=5, seed=0):
+    """
+    Benchmarks the hot paths of the app on synthetic catalogues.
+
+    Catalogue-wide stages (process_data on a written data.json, get_dataset
+    on a written columnar catalog, recommendation, title_search with queries
+    that drop a letter from a title and artist) run once per size. Every load
+    reads and parses the file again into a fresh frame;
+    the per-song stages (readability metrics, get_text_chunks and
+    get_vectorstore with the offline hash embedder) run per lyric on a sample.
+
+    Parameters:
+    - sizes (list of int): The catalogue sizes.
+    - repeat (int): The number of timed runs of each catalogue-wide stage.
+    - seed (int): The seed of the generator.
+
+    Returns:
+    - list: One result dict per benchmark and size.
+    """
+    # The offline embedder stands in for OpenAI so no network is involved
+    os.environ["EMBEDDER"] = "local"
+    import app_function
+    import choosingdata
+    from catalog import write_catalog
+    from readability import analyzeLyrics
+
+    vocabulary = get_vocabulary()
+    results = []
+
+    def record(name, n, function, repeat):
+        result = {"benchmark": name, "songs": n, **measure(function, repeat)}
+        results.append(result)
+        print(f"{name:<22} {n:>9} songs  p50 {result['p50_ms']:10.3f} ms  "
+              f"p99 {result['p99_ms']:10.3f} ms  peak {result['peak_memory_mb']:9.1f} MB")
+
+    def load(path):
+        # Drop the loaded dataset so every call reads the file again
+        choosingdata._datasets.pop(path, None)
+        return choosingdata.get_dataset(path)
+
+    for n in sizes:
+        songs = generate_catalogue(n, seed, vocabulary)
+        directory = tempfile.TemporaryDirectory()
+        json_path = os.path.join(directory.name, "data.json")
+        catalog_path = os.path.join(directory.name, "data.parquet")
+        write_catalog(songs, catalog_path)
+        if n <= JSON_MAX_SONGS:
+            with open(json_path, "w") as file:
+                json.dump(songs, file)
+            record("process_data", n, lambda: choosingdata.process_data(json_path), repeat)
+        record("get_dataset", n, lambda: load(catalog_path), repeat)
+
+        dataset = load(catalog_path)
+        prepared, buckets = dataset.df, dataset.buckets
+        choices = list(zip(
+            np.random.default_rng(seed).choice(list(choosingdata.DANCE_CHOICES), RECOMMENDATION_CALLS),
+            np.random.default_rng(seed + 1).choice(list(choosingdata.VALENCE_CHOICES), RECOMMENDATION_CALLS),
+            np.random.default_rng(seed + 2).choice(list(choosingdata.DIFFICULTY_CHOICES), RECOMMENDATION_CALLS),
+        ))
+        calls = iter(choices * (repeat + 2))
+        record("recommendation", n,
+               lambda: choosingdata.recommendation(prepared, *next(calls), buckets=buckets),
+               RECOMMENDATION_CALLS)
+
+        index = dataset.title_search
+        queries = []
+        for i in np.random.default_rng(seed).integers(0, n, SEARCH_CALLS):
+            query = f"{songs[i]['title']} {songs[i]['artist']}"
+            queries.append(query[:2] + query[3:])
+        queries = iter(queries * 2)
+        record("title_search", n, lambda: index.search(next(queries)), SEARCH_CALLS - 1)
+
+        sample = iter([song["lyrics"] for song in songs[:LYRICS_SAMPLE_SIZE]] * 2)
+        record("readability", n, lambda: analyzeLyrics(next(sample)), min(n, LYRICS_SAMPLE_SIZE) - 1)
+        sample = iter([song["lyrics"] for song in songs[:LYRICS_SAMPLE_SIZE]] * 2)
+        record("get_text_chunks", n, lambda: app_function.get_text_chunks(next(sample)), min(n, LYRICS_SAMPLE_SIZE) - 1)
+        sample = iter([song["lyrics"] for song in songs[:LYRICS_SAMPLE_SIZE]] * 2)
+        record("get_vectorstore", n,
+               lambda: app_function.get_vectorstore(app_function.get_text_chunks(next(sample))),
+               min(n, LYRICS_SAMPLE_SIZE) - 1)
+        del songs, dataset, prepared, buckets, index
+        choosingdata._datasets.clear()
+        directory.cleanup()
+    return results
+
+
+def git_revision():
+    """Returns the commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints how the median latency changed against an earlier run.
+
+    Parameters:
+    - results (list): The results of this run.
+    - baseline (dict): The JSON report of the earlier run.
+    """
+    previous = {(result["benchmark"], result["songs"]): result for result in baseline["results"]}
+    for result in results:
+        before = previous.get((result["benchmark"], result["songs"]))
+        if before is not None and before["p50_ms"] > 0:
+            print(f"{result['benchmark']:<22} {result['songs']:>9} songs  "
+                  f"p50 x{result['p50_ms'] / before['p50_ms']:.2f}  "
+                  f"peak x{result['peak_memory_mb'] / max(before['peak_memory_mb'], 1e-9):.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the app on synthetic catalogues.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated catalogue sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each catalogue-wide stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark.json", help="JSON report to write")
+    parser.add_argument("--baseline", default=None, help="earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks([int(size) for size in args.sizes.split(",")], args.repeat, args.seed)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.out, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Wrote {args.out}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            compare(results, json.load(file))
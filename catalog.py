@@ -0,0 +1,161 @@
+import argparse
+import json
+import mmap
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+CATALOG_FILENAME = "data.parquet"
+
+COLUMNS = [
+    ("id", pa.string()),
+    ("title", pa.string()),
+    ("artist", pa.string()),
+    ("danceability", pa.float64()),
+    ("valence", pa.float64()),
+    ("speechiness", pa.float64()),
+    ("fres", pa.float64()),
+    ("vocabComplex", pa.float64()),
+    ("sentenceLength", pa.float64()),
+    ("avgSyllable", pa.float64()),
+    ("lang", pa.string()),
+    ("lyrics_offset", pa.int64()),
+    ("lyrics_length", pa.int64()),
+]
+
+
+def write_catalog(songs, path=CATALOG_FILENAME, batch_size=10000):
+    """
+    Writes songs as a columnar catalog: a Parquet file with the metadata and
+    features, and a separate blob with the UTF-8 lyrics of all songs. Each row
+    stores the offset and length of its lyrics in the blob.
+
+    Every export writes a new blob whose name is recorded in the Parquet
+    metadata, and the Parquet file is swapped in last, so readers always see
+    a matching pair. The blob of the previous export is kept until the next
+    one, so a reader that has just read the old Parquet file can still open it.
+
+    Parameters:
+    - songs (iterable of dict): Songs in the data.json schema.
+    - path (str): The Parquet file to write.
+    - batch_size (int): The number of songs per row group.
+
+    Returns:
+    - int: The number of songs written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    blob_name = f"lyrics-{uuid.uuid4().hex[:16]}.bin"
+    schema = pa.schema(COLUMNS, metadata={"lyrics_file": blob_name})
+    count = 0
+
+    blob_tmp = os.path.join(directory, blob_name + ".tmp")
+    table_tmp = path + ".tmp"
+    previous = lyrics_file(path) if os.path.exists(path) else None
+    try:
+        with open(blob_tmp, "wb") as blob, pq.ParquetWriter(table_tmp, schema) as writer:
+            offset = 0
+            batch = {name: [] for name, _ in COLUMNS}
+
+            def flush():
+                if batch["id"]:
+                    writer.write_table(pa.table(batch, schema=schema))
+                    for values in batch.values():
+                        values.clear()
+
+            for song in songs:
+                lyrics = song["lyrics"].encode("utf-8")
+                blob.write(lyrics)
+                for name, _ in COLUMNS[:-2]:
+                    batch[name].append(song[name])
+                batch["lyrics_offset"].append(offset)
+                batch["lyrics_length"].append(len(lyrics))
+                offset += len(lyrics)
+                count += 1
+                if len(batch["id"]) >= batch_size:
+                    flush()
+            flush()
+
+        os.replace(blob_tmp, os.path.join(directory, blob_name))
+        os.replace(table_tmp, path)
+    finally:
+        for tmp in (blob_tmp, table_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # Remove blobs no catalog in this directory points to anymore, except the previous generation
+    in_use = {lyrics_file(os.path.join(directory, name))
+              for name in os.listdir(directory) if name.endswith(".parquet")}
+    in_use.add(previous)
+    for name in os.listdir(directory):
+        if name.startswith("lyrics-") and name.endswith(".bin") and name not in in_use:
+            os.remove(os.path.join(directory, name))
+    return count
+
+
+def lyrics_file(source):
+    """
+    Returns the name of the lyrics blob a catalog points to.
+
+    Parameters:
+    - source (str or file-like): The Parquet file of the catalog.
+
+    Returns:
+    - str or None: The blob file name, or None for other Parquet files.
+    """
+    metadata = pq.read_schema(source).metadata or {}
+    name = metadata.get(b"lyrics_file")
+    return name.decode("utf-8") if name else None
+
+
+def read_catalog(source):
+    """
+    Reads the metadata and features of a catalog, without any lyrics.
+
+    Parameters:
+    - source (str or file-like): The Parquet file of the catalog.
+
+    Returns:
+    - tuple: The songs as a DataFrame and the name of the lyrics blob.
+    """
+    table = pq.read_table(source)
+    name = (table.schema.metadata or {}).get(b"lyrics_file", b"").decode("utf-8")
+    return table.to_pandas(), name
+
+
+class LyricsReader:
+    """
+    Reads lyrics on demand from a memory-mapped lyrics blob, so only the lyrics
+    that are actually shown are ever materialized.
+
+    Parameters:
+    - path (str): The lyrics blob.
+    - ids, offsets, lengths (array-like): The Spotify ID, byte offset and byte
+      length of every song's lyrics in the blob.
+    """
+
+    def __init__(self, path, ids, offsets, lengths):
+        with open(path, "rb") as file:
+            self._blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        self._index = {song_id: (int(offset), int(length)) for song_id, offset, length in zip(ids, offsets, lengths)}
+
+    def read(self, offset, length):
+        """Returns the lyrics stored at the given byte offset and length."""
+        return self._blob[offset : offset + length].decode("utf-8")
+
+    def get(self, song_id):
+        """Returns the lyrics of a song by its Spotify ID."""
+        return self.read(*self._index[song_id])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert data.json into a columnar catalog.")
+    parser.add_argument("source", nargs="?", default="data.json")
+    parser.add_argument("--out", default=CATALOG_FILENAME)
+    args = parser.parse_args()
+
+    with open(args.source, "r") as file:
+        songs = json.load(file)
+    print(f"Wrote {write_catalog(songs, args.out)} songs to {args.out}")
@@ -0,0 +1,79 @@
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.retrievers import BaseRetriever
+
+import metrics
+
+
+# LangChain subclasses used by app_function.py. They live in their own module
+# so that app_function.py can defer importing LangChain until a chat starts.
+
+
+class StaticRetriever(BaseRetriever):
+    """
+    Retriever that returns the same documents for every question.
+    """
+
+    documents: list
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """
+    Callback handler that puts every new token of a streaming model on a queue.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.put(token)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Callback handler that records the retrieval and model calls of a chain run
+    as the metrics spans "chat.retrieve", "chat.llm" and "chat.first_token".
+    """
+
+    def __init__(self):
+        self._starts = {}
+        self._streaming = set()
+
+    def _start(self, run_id):
+        self._starts[run_id] = time.perf_counter()
+
+    def _finish(self, name, run_id, error=None):
+        start = self._starts.pop(run_id, None)
+        self._streaming.discard(run_id)
+        if start is not None:
+            metrics.record(name, time.perf_counter() - start, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._finish("chat.retrieve", run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._finish("chat.retrieve", run_id, type(error).__name__)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id not in self._streaming and run_id in self._starts:
+            self._streaming.add(run_id)
+            metrics.record("chat.first_token", time.perf_counter() - self._starts[run_id])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish("chat.llm", run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish("chat.llm", run_id, type(error).__name__)
@@ -1,7 +1,179 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from itertools import product
+
+import numpy as np
 import pandas as pd
 
-def process_data(file_path):
-    df = pd.read_json(file_path)
+from levels import apply_levels, levels_path
+from title_search import TitleSearch
+
+LEVELS = ['Low', 'Medium', 'High']
+DANCE_CHOICES = {'Low': 'Low', 'Medium': 'Medium', 'High': 'High'}
+VALENCE_CHOICES = {'Negative': 'Low', 'Neutral': 'Medium', 'Positive': 'High'}
+DIFFICULTY_CHOICES = {'Easy': 'Low', 'Medium': 'Medium', 'Hard': 'High'}
+
+_rng = np.random.default_rng()
+
+
+class PreparedDataset:
+    """
+    A processed song DataFrame, its bucket index, its title search index and
+    the signature of its source file.
+
+    Datasets loaded from a columnar catalog have no lyrics column; their lyrics
+    are read on demand through lyrics_reader.
+    """
+
+    def __init__(self, df, mtime, digest, buckets=None, lyrics_reader=None, title_search=None, similarity=None):
+        self.df = df
+        self.buckets = build_bucket_index(df) if buckets is None else buckets
+        self.title_search = TitleSearch(df) if title_search is None else title_search
+        self.mtime = mtime
+        self.digest = digest
+        self.lyrics_reader = lyrics_reader
+        self._similarity = similarity
+        self._similarity_lock = threading.Lock()
+        self._lyrics_index = None
+        self._lyrics_index_rows = None
+        self._lyrics_index_lock = threading.Lock()
+
+    def get_lyrics(self, row):
+        """Return the lyrics of a row of df."""
+        if self.lyrics_reader is None:
+            return row['lyrics']
+        return self.lyrics_reader.read(row['lyrics_offset'], row['lyrics_length'])
+
+    @property
+    def similarity(self):
+        """The SimilarityIndex of df, built on first use."""
+        with self._similarity_lock:
+            if self._similarity is None:
+                from similarity import SimilarityIndex
+
+                self._similarity = SimilarityIndex(self.df)
+        return self._similarity
+
+    def songs_with(self, lyrics_index, term, difficulty_choice=None):
+        """
+        Return the songs of df whose lyrics contain a word or phrase, the songs
+        using it most first, with the number of uses in a count column.
+
+        Only the postings of the term in lyrics_index are read, never the lyrics.
+        Songs of the index missing from df are skipped.
+        """
+        with self._lyrics_index_lock:
+            if self._lyrics_index is not lyrics_index:
+                # The first row of each song in df, or -1 for songs missing from df
+                first = np.flatnonzero(~self.df['id'].duplicated().to_numpy())
+                indexer = pd.Index(self.df['id'].iloc[first]).get_indexer(lyrics_index.ids)
+                self._lyrics_index_rows = np.where(indexer >= 0, first[indexer], -1)
+                self._lyrics_index = lyrics_index
+            rows = self._lyrics_index_rows
+
+        positions, counts = lyrics_index.postings(term)
+        positions = rows[positions]
+        keep = positions >= 0
+        if difficulty_choice is not None:
+            if difficulty_choice not in DIFFICULTY_CHOICES:
+                raise ValueError(f"Unknown difficulty choice: {difficulty_choice!r}")
+            levels = self.df['difficulty_level'].cat
+            code = levels.categories.get_loc(DIFFICULTY_CHOICES[difficulty_choice])
+            keep &= levels.codes.to_numpy()[np.where(keep, positions, 0)] == code
+
+        songs = self.df.iloc[positions[keep]].copy()
+        songs['count'] = counts[keep]
+        return songs
+
+    def find_songs(self, query, k=5):
+        """Return the k songs of df whose title and artist best match a query, with their score, best first."""
+        positions, scores = self.title_search.search(query, k)
+        songs = self.df.iloc[positions].copy()
+        songs['score'] = scores
+        return songs
+
+    def similar_songs(self, song_id, k=5):
+        """
+        Return the k songs of df closest to a song in features, with their
+        distance, closest first; none if the song is not in df, e.g. after the
+        data was refreshed.
+        """
+        try:
+            positions, distances = self.similarity.nearest(song_id, k)
+        except KeyError:
+            positions, distances = np.empty(0, dtype=np.int64), np.empty(0)
+        songs = self.df.iloc[positions].copy()
+        songs['distance'] = distances
+        return songs
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+def _mtimes(file_path):
+    levels_file = levels_path(file_path)
+    levels_mtime = os.stat(levels_file).st_mtime_ns if os.path.exists(levels_file) else None
+    return os.stat(file_path).st_mtime_ns, levels_mtime
+
+def get_dataset(file_path):
+    """
+    Return the process-wide prepared dataset for file_path, either a data.json
+    or a columnar catalog (.parquet) written by catalog.write_catalog().
+
+    Levels are binned against the cutoffs stored in the levels.json next to
+    the file when there is one, and computed from the data otherwise.
+
+    The dataset is rebuilt only when the mtime of the file or its levels.json
+    changes and their content hash differs from the one already loaded. The
+    new dataset is fully built before it replaces the old one, so callers
+    never see a half-built frame.
+    """
+    mtime = _mtimes(file_path)
+    dataset = _datasets.get(file_path)
+    if dataset is not None and dataset.mtime == mtime:
+        return dataset
+
+    with _datasets_lock:
+        dataset = _datasets.get(file_path)
+        if dataset is not None and dataset.mtime == mtime:
+            return dataset
+
+        with open(file_path, 'rb') as file:
+            raw = file.read()
+        levels_file = levels_path(file_path)
+        raw_levels = b''
+        if os.path.exists(levels_file):
+            with open(levels_file, 'rb') as file:
+                raw_levels = file.read()
+        digest = hashlib.sha256(raw + b'\0' + raw_levels).hexdigest()
+        cutoffs = json.loads(raw_levels) if raw_levels else None
+
+        if dataset is not None and dataset.digest == digest:
+            dataset = PreparedDataset(dataset.df, mtime, digest, dataset.buckets, dataset.lyrics_reader,
+                                      dataset.title_search, dataset._similarity)
+        elif file_path.endswith('.parquet'):
+            from catalog import LyricsReader, read_catalog
+
+            df, lyrics_file = read_catalog(io.BytesIO(raw))
+            lyrics_reader = LyricsReader(os.path.join(os.path.dirname(file_path), lyrics_file),
+                                         df['id'], df['lyrics_offset'], df['lyrics_length'])
+            dataset = PreparedDataset(process_data(file_path, df, cutoffs), mtime, digest,
+                                      lyrics_reader=lyrics_reader)
+        else:
+            dataset = PreparedDataset(process_data(io.BytesIO(raw), levels=cutoffs), mtime, digest)
+        _datasets[file_path] = dataset
+    return dataset
+
+def process_data(file_path, df=None, levels=None):
+    if df is None:
+        df = pd.read_json(file_path)
+
+    # Stored cutoffs keep every song's level stable as songs are added
+    if levels is not None:
+        return apply_levels(df, levels)
 
     df['danceability_level'] = categorize_level(df['danceability'])
     df['valence_level'] = categorize_level(df['valence'])
@@ -37,27 +209,157 @@ def categorize_difficulty(column):
     labels = ["Low", "Medium", "High"]
     return pd.cut(column, bins=bins, labels=labels, include_lowest=True)
 
-def recommendation(df, dance_choice, valence_choice, difficulty_choice):
-    if dance_choice == "Low":
-        df = df[df['danceability_level'] == "Low"]
-    elif dance_choice == "Medium":
-        df = df[df['danceability_level'] == "Medium"]
-    elif dance_choice == "High":
-        df = df[df['danceability_level'] == "High"]
-
-    if valence_choice == "Negative":
-        df = df[df['valence_level'] == "Low"]
-    elif valence_choice == "Neutral":
-        df = df[df['valence_level'] == "Medium"]
-    elif valence_choice == "Positive":
-        df = df[df['valence_level'] == "High"]
-
-    if difficulty_choice == "Easy":
-        df = df[df['difficulty_level'] == "Low"]
-    elif difficulty_choice == "Medium":
-        df = df[df['difficulty_level'] == "Medium"]
-    elif difficulty_choice == "Hard":
-        df = df[df['difficulty_level'] == "High"]
-
-    chosen = df.sample() # random choose 1 song
-    return chosen
\ No newline at end of file
+def build_bucket_index(df):
+    """
+    Map every (danceability_level, valence_level, difficulty_level) combination
+    to an int32 array of row positions in df.
+
+    An empty combination is filled with the rows of its nearest non-empty
+    combinations (smallest total level distance, ties pooled), so every key
+    can always be sampled from.
+    """
+    codes = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    for column in ['danceability_level', 'valence_level', 'difficulty_level']:
+        level_codes = pd.Categorical(df[column], categories=LEVELS).codes
+        valid &= level_codes >= 0
+        codes = codes * len(LEVELS) + level_codes
+
+    positions = np.flatnonzero(valid).astype(np.int32)
+    codes = codes[valid]
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=len(LEVELS) ** 3)
+    groups = np.split(positions[order], np.cumsum(counts)[:-1])
+
+    exact = {}
+    for code, key in enumerate(product(range(len(LEVELS)), repeat=3)):
+        exact[key] = groups[code]
+
+    buckets = {}
+    for key, rows in exact.items():
+        if len(rows) == 0:
+            rows = _nearest_rows(exact, key)
+        buckets[tuple(LEVELS[level] for level in key)] = rows
+    return buckets
+
+def _nearest_rows(exact, key):
+    by_distance = {}
+    for other, rows in exact.items():
+        if len(rows):
+            distance = sum(abs(a - b) for a, b in zip(key, other))
+            by_distance.setdefault(distance, []).append(rows)
+    if not by_distance:
+        return np.empty(0, dtype=np.int32)
+    return np.concatenate(by_distance[min(by_distance)])
+
+def recommendation(df, dance_choice, valence_choice, difficulty_choice, buckets=None):
+    try:
+        key = (DANCE_CHOICES[dance_choice], VALENCE_CHOICES[valence_choice],
+               DIFFICULTY_CHOICES[difficulty_choice])
+    except KeyError as e:
+        raise ValueError(f'Unknown choice: {e.args[0]}') from None
+
+    if buckets is None:
+        buckets = build_bucket_index(df)
+    rows = buckets[key]
+    if len(rows) == 0:
+        raise ValueError('No songs to recommend from')
+
+    chosen = df.iloc[[rows[_rng.integers(len(rows))]]] # random choose 1 song
+    return chosen
+
+def batch_recommendation(buckets, dance_choices, valence_choices, difficulty_choices,
+                         k=1, seed=None, exclude=None, chunk_size=65536):
+    """
+    Recommend k distinct songs to each of many users in one vectorized pass.
+
+    Parameters:
+    - buckets (dict): The bucket index from build_bucket_index().
+    - dance_choices, valence_choices, difficulty_choices (array-like of str):
+      One choice per user, using the same values as recommendation().
+    - k (int): Number of distinct songs per user.
+    - seed (int or None): Seed for reproducible picks.
+    - exclude (array-like of int or None): An (n_users, m) array of row
+      positions each user has already seen, padded with -1.
+    - chunk_size (int): Number of users sampled together, bounding memory.
+
+    Returns:
+    - numpy.ndarray: An (n_users, k) int64 array of row positions into the
+      dataset. Slots are -1 when a user's bucket has fewer than k unseen songs.
+    """
+    rng = np.random.default_rng(seed)
+    keys = list(product(LEVELS, repeat=3))
+
+    codes = np.zeros(len(dance_choices), dtype=np.int64)
+    for choices, mapping in [(dance_choices, DANCE_CHOICES), (valence_choices, VALENCE_CHOICES),
+                             (difficulty_choices, DIFFICULTY_CHOICES)]:
+        choices = np.asarray(choices)
+        level_codes = pd.Categorical(choices, categories=list(mapping)).codes
+        if (level_codes < 0).any():
+            raise ValueError(f'Unknown choice: {choices[level_codes < 0][0]}')
+        codes = codes * len(LEVELS) + level_codes
+
+    n_users = len(codes)
+    if exclude is None:
+        exclude = np.full((n_users, 0), -1, dtype=np.int64)
+    else:
+        exclude = np.asarray(exclude, dtype=np.int64).reshape(n_users, -1)
+    n_rows = max((int(rows.max()) + 1 for rows in buckets.values() if len(rows)), default=0)
+    seen = np.where((exclude >= 0) & (exclude < n_rows), exclude, n_rows)
+
+    result = np.full((n_users, k), -1, dtype=np.int64)
+    for code, key in enumerate(keys):
+        candidates = np.asarray(buckets[key], dtype=np.int64)
+        users = np.flatnonzero(codes == code)
+        if len(users) == 0 or len(candidates) == 0:
+            continue
+
+        # Position -> index into candidates, -1 when not a candidate
+        local_index = np.full(n_rows + 1, -1, dtype=np.int64)
+        local_index[candidates] = np.arange(len(candidates))
+
+        # Large buckets: draw with replacement and redraw the few collisions.
+        # Small buckets, and rows that keep colliding: rank random keys.
+        if len(candidates) > 32 * k:
+            users = _sample_rejection(rng, candidates, local_index, seen, users, k, result, chunk_size)
+        step = max(1, chunk_size * 64 // len(candidates))
+        for start in range(0, len(users), step):
+            chunk = users[start:start + step]
+            result[chunk] = _sample_dense(rng, candidates, local_index[seen[chunk]], k)
+
+    return result
+
+def _sample_rejection(rng, candidates, local_index, seen, users, k, result, chunk_size, rounds=8):
+    unfinished = []
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start:start + chunk_size]
+        local = rng.integers(0, len(candidates), size=(len(chunk), k))
+        seen_local = local_index[seen[chunk]]
+        for _ in range(rounds):
+            order = np.sort(local, axis=1)
+            invalid = (order[:, 1:] == order[:, :-1]).any(axis=1)
+            invalid |= (local[:, :, None] == seen_local[:, None, :]).any(axis=(1, 2))
+            if not invalid.any():
+                break
+            local[invalid] = rng.integers(0, len(candidates), size=(int(invalid.sum()), k))
+        else:
+            unfinished.append(chunk[invalid])
+            chunk, local = chunk[~invalid], local[~invalid]
+        result[chunk] = candidates[local]
+    return np.concatenate(unfinished) if unfinished else users[:0]
+
+def _sample_dense(rng, candidates, seen_local, k):
+    ranks = rng.random((len(seen_local), len(candidates)))
+    rows, slots = np.nonzero(seen_local >= 0)
+    ranks[rows, seen_local[rows, slots]] = 2.0 # seen songs rank last
+
+    top = min(k, len(candidates))
+    picked = np.argpartition(ranks, top - 1, axis=1)[:, :top]
+    picked_ranks = np.take_along_axis(ranks, picked, axis=1)
+    order = np.argsort(picked_ranks, axis=1)
+    picked = np.take_along_axis(picked, order, axis=1)
+    picked_ranks = np.take_along_axis(picked_ranks, order, axis=1)
+
+    chosen = np.full((len(ranks), k), -1, dtype=np.int64)
+    chosen[:, :top] = np.where(picked_ranks < 1.0, candidates[picked], -1)
+    return chosen
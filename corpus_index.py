@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+import uuid
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from text_chunks import get_text_chunks
+
+
+CORPUS_INDEX_DIR = "corpus_index"
+# Each build is written to a directory of its own; this file names the current one
+CURRENT_FILENAME = "CURRENT"
+VECTORS_FILENAME = "vectors.npy"
+# The UTF-8 texts of all chunks back to back, and the byte offset where each starts
+CHUNKS_FILENAME = "chunks.bin"
+OFFSETS_FILENAME = "chunk_offsets.npy"
+MANIFEST_FILENAME = "manifest.json"
+
+
+class LocalHashEmbeddings(Embeddings):
+    """
+    A deterministic, offline embedder that hashes words and word pairs into a
+    fixed number of signed buckets. It needs no network or model download, so
+    it is meant for offline builds and tests rather than answer quality.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.model = f"local-hash-{size}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        words = re.findall(r"[a-z0-9']+", text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def get_embeddings(name="openai"):
+    """
+    Returns the embedding backend registered under the given name.
+
+    Parameters:
+    - name (str): "openai" for OpenAIEmbeddings or "local" for LocalHashEmbeddings.
+
+    Returns:
+    - Embeddings: The embedding backend.
+    """
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings()
+    if name == "local":
+        return LocalHashEmbeddings()
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+def lyrics_hash(lyrics):
+    """Returns the hash used to detect changed lyrics."""
+    return hashlib.sha256(lyrics.encode("utf-8")).hexdigest()
+
+
+class CorpusIndex:
+    """
+    The persisted vectors and texts of the lyric chunks of every song, laid
+    out so that the chunks of each song are contiguous, plus the position of
+    each song's chunks. Vectors and texts are memory-mapped, so only the
+    chunks of the songs actually chatted about are ever read.
+    """
+
+    def __init__(self, vectors, texts, offsets, manifest):
+        self.chunk_vectors = vectors
+        self.chunk_texts = texts
+        self.chunk_offsets = offsets
+        self.manifest = manifest
+        self.songs = manifest["songs"]
+
+    @classmethod
+    def load(cls, directory=CORPUS_INDEX_DIR):
+        """
+        Loads the current build of build_index(), memory-mapping its vectors
+        and chunk texts.
+
+        Parameters:
+        - directory (str): The directory the index was written to.
+
+        Returns:
+        - CorpusIndex or None: The index, or None if none has been built,
+          or only by a version that kept the chunk texts in the manifest.
+        """
+        build = current_build(directory)
+        names = [MANIFEST_FILENAME, VECTORS_FILENAME, OFFSETS_FILENAME, CHUNKS_FILENAME]
+        if build is None or not all(os.path.exists(os.path.join(build, name)) for name in names):
+            return None
+        with open(os.path.join(build, MANIFEST_FILENAME), "r") as file:
+            manifest = json.load(file)
+        vectors = np.load(os.path.join(build, VECTORS_FILENAME), mmap_mode="r")
+        offsets = np.load(os.path.join(build, OFFSETS_FILENAME), mmap_mode="r")
+        texts_path = os.path.join(build, CHUNKS_FILENAME)
+        with open(texts_path, "rb") as file:
+            texts = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(texts_path) else b""
+        return cls(vectors, texts, offsets, manifest)
+
+    def embeddings(self):
+        """Returns the embedding backend the index was built with, for queries."""
+        return get_embeddings(self.manifest["embedder"])
+
+    def has(self, song_id, lyrics):
+        """Checks whether the index holds up-to-date chunks for a song."""
+        song = self.songs.get(song_id)
+        return song is not None and song["hash"] == lyrics_hash(lyrics)
+
+    def vectors(self, song_id):
+        """Returns the chunk texts and stored vectors of a song."""
+        song = self.songs[song_id]
+        start, count = song["start"], song["count"]
+        offsets = self.chunk_offsets[start : start + count + 1].tolist()
+        texts = [self.chunk_texts[begin:end].decode("utf-8") for begin, end in zip(offsets, offsets[1:])]
+        return texts, np.array(self.chunk_vectors[start : start + count])
+
+    def vectorstore(self, song_id, embeddings=None):
+        """
+        Builds a per-song FAISS vector store from the stored vectors, without
+        embedding anything.
+
+        Parameters:
+        - song_id (str): The Spotify ID of the song.
+        - embeddings (Embeddings): Used to embed queries; defaults to the build embedder.
+
+        Returns:
+        - FAISS: A FAISS vector store over the song's chunks.
+        """
+        from langchain_community.vectorstores import FAISS
+
+        texts, vectors = self.vectors(song_id)
+        return FAISS.from_embeddings(
+            text_embeddings=list(zip(texts, vectors.tolist())),
+            embedding=embeddings or self.embeddings(),
+        )
+
+
+def current_build(directory=CORPUS_INDEX_DIR):
+    """
+    Returns the directory of the current build of the corpus index.
+
+    Parameters:
+    - directory (str): The directory the index was written to.
+
+    Returns:
+    - str or None: The build directory, or None if none has been built.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILENAME), "r") as file:
+            name = file.read().strip()
+    except FileNotFoundError:
+        return None
+    build = os.path.join(directory, name)
+    return build if os.path.isdir(build) else None
+
+
+def build_index(
+    data_path="data.json", directory=CORPUS_INDEX_DIR, embedder="openai", batch_size=64
+):
+    """
+    Chunks and embeds every song in the dataset into one persisted index.
+    Songs whose lyrics are unchanged since the last build reuse their stored
+    vectors; only new or changed songs are embedded.
+
+    Every build writes its vectors, chunk texts and manifest to a new
+    directory and then swaps the CURRENT pointer to it, so readers always
+    see files of the same build.
+    The previous build is kept until the next one, so a reader that has just
+    read the old pointer can still open it.
+
+    Parameters:
+    - data_path (str): The dataset exported by data_fetch.py.
+    - directory (str): The directory to write the index to.
+    - embedder (str): The name of the embedding backend, see get_embeddings().
+    - batch_size (int): The number of chunks sent to the embedder at once.
+
+    Returns:
+    - dict: The number of songs reused and embedded.
+    """
+    embeddings = get_embeddings(embedder)
+    with open(data_path, "r") as file:
+        songs = json.load(file)
+
+    previous = CorpusIndex.load(directory)
+    previous_build = current_build(directory)
+    if previous is not None and previous.manifest["model"] != embeddings.model:
+        previous = None
+
+    # Collect the chunks of every song, reusing vectors where possible
+    song_chunks = {}
+    hashes = {}
+    reused = {}
+    to_embed = []
+    for song in songs:
+        song_id, lyrics = song["id"], song["lyrics"]
+        if song_id in song_chunks:
+            continue
+        hashes[song_id] = lyrics_hash(lyrics)
+        if previous is not None and previous.has(song_id, lyrics):
+            song_chunks[song_id], reused[song_id] = previous.vectors(song_id)
+        else:
+            song_chunks[song_id] = get_text_chunks(lyrics)
+            to_embed.extend(song_chunks[song_id])
+
+    embedded = []
+    for start in range(0, len(to_embed), batch_size):
+        embedded.extend(embeddings.embed_documents(to_embed[start : start + batch_size]))
+        print(f"Embedded {min(start + batch_size, len(to_embed))}/{len(to_embed)} chunks")
+    embedded = np.asarray(embedded, dtype=np.float32)
+
+    # Lay the chunks out contiguously per song
+    manifest = {
+        "embedder": embedder,
+        "model": embeddings.model,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "songs": {},
+    }
+    blocks = []
+    texts_all = []
+    position = 0
+    for song_id, texts in song_chunks.items():
+        if song_id in reused:
+            vectors = reused[song_id]
+        else:
+            vectors = embedded[position : position + len(texts)]
+            position += len(texts)
+        manifest["songs"][song_id] = {
+            "hash": hashes[song_id],
+            "start": len(texts_all),
+            "count": len(texts),
+        }
+        texts_all.extend(texts)
+        blocks.append(vectors)
+
+    if not blocks:
+        raise ValueError(f"No songs found in {data_path}")
+    vectors = np.concatenate(blocks).astype(np.float32)
+
+    # Write the build to a directory of its own, then point CURRENT at it
+    os.makedirs(directory, exist_ok=True)
+    name = f"build-{uuid.uuid4().hex[:16]}"
+    build = os.path.join(directory, name)
+    pointer = os.path.join(directory, CURRENT_FILENAME)
+    os.makedirs(build)
+    try:
+        np.save(os.path.join(build, VECTORS_FILENAME), vectors)
+        offsets = [0]
+        with open(os.path.join(build, CHUNKS_FILENAME), "wb") as file:
+            for text in texts_all:
+                encoded = text.encode("utf-8")
+                file.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        np.save(os.path.join(build, OFFSETS_FILENAME), np.array(offsets, dtype=np.int64))
+        with open(os.path.join(build, MANIFEST_FILENAME), "w") as file:
+            json.dump(manifest, file)
+        with open(pointer + ".tmp", "w") as file:
+            file.write(name)
+        os.replace(pointer + ".tmp", pointer)
+    except BaseException:
+        shutil.rmtree(build, ignore_errors=True)
+        raise
+    finally:
+        if os.path.exists(pointer + ".tmp"):
+            os.remove(pointer + ".tmp")
+
+    # Remove older builds, except the previous one
+    kept = {name, previous_build and os.path.basename(previous_build)}
+    for entry in os.listdir(directory):
+        if entry.startswith("build-") and entry not in kept:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    return {"reused": len(reused), "embedded": len(song_chunks) - len(reused)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the corpus-wide lyrics index.")
+    parser.add_argument("--data", default="data.json")
+    parser.add_argument("--out", default=CORPUS_INDEX_DIR)
+    parser.add_argument("--embedder", default="openai", choices=["openai", "local"])
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+    print(build_index(args.data, args.out, args.embedder, args.batch_size))
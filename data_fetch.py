@@ -1,15 +1,23 @@
-from bs4 import BeautifulSoup
-from datetime import datetime, timedelta
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import gzip
 import json
-import re
+import textwrap
+import threading
+import time
+import http_client
+import metrics
 import requests
-import nltk
-from nltk.corpus import cmudict
-# nltk.download('punkt')
-# nltk.download('cmudict')
+from readability import analyzeLyrics
+# The single-metric functions used to live here and are re-exported for compatibility
+from readability import countSyllables, getFRES, vocabComplex, sentenceLength, avgSyllable  # noqa: F401
 from langdetect import detect
 import os
 from dotenv import load_dotenv
+from song_store import openStore
+from levels import compute_levels, load_levels, save_levels, update_levels
+import pandas as pd
 
 
 def init():
@@ -24,49 +32,77 @@ def init():
     spotify_cid = os.getenv("SPOTIFY_CID")
     spotify_secret = os.getenv("SPOTIFY_SECRET")
     genius_token = os.getenv("GENIUS_TOKEN")
-    headers = {"Authorization": "Bearer " + genius_token}
+    # A replay needs no credentials; a live run without them would fail every song
+    if genius_token is None and http_client.HTTP_MODE != "replay":
+        raise RuntimeError("GENIUS_TOKEN is not set")
+    headers = {"Authorization": "Bearer " + (genius_token or "")}
 
 
 # Cache
 
 CACHE_FILENAME = "cache.json"
+STORE_FILENAME = "cache.db"
+LEVELS_FILENAME = "levels.json"
+METRICS_FILENAME = "ingest_metrics.json"
+
+# Number of songs fetched concurrently by updateCache
+WORKERS = 8
 
 def openCache():
-    '''Check if cache file exists, if so load it, if not create new cache'''
-    try:
-        cache_file = open(CACHE_FILENAME, "r")
-        cache_contents = cache_file.read()
-        cache_dict = json.loads(cache_contents)
-        cache_file.close()
-    except:
-        cache_dict = {}
-    return cache_dict
-
-def saveCache(cache_dict):
-    '''Save cache file'''
-    cache_file = open(CACHE_FILENAME, "w")
-    contents_to_write = json.dumps(cache_dict)
-    cache_file.write(contents_to_write)
-    cache_file.close()
+    '''Open the song store, importing an existing cache.json into it the first time.'''
+    return openStore(STORE_FILENAME, CACHE_FILENAME)
 
 
 # Billboard scraper
 
-def scrapeBillboard(date):
+BILLBOARD_CACHE_DIR = "billboard_cache"
+
+# lxml is much faster than the built-in parser but optional
+try:
+    import lxml
+    BILLBOARD_PARSER = "lxml"
+except ImportError:
+    BILLBOARD_PARSER = "html.parser"
+
+def fetchBillboardPage(date):
     '''
-    Scrape the Billboard Hot 100 chart for a given date.
-    
+    Get the HTML of the Billboard Hot 100 chart for a given date.
+
+    Charts of past weeks never change, so their pages are kept in
+    BILLBOARD_CACHE_DIR and only downloaded once. While recording, the
+    pages are downloaded again so that the archive holds them too.
+
     Parameters:
         date (datetime.date): The date of the chart.
-        
+
     Returns:
-        list: A list of tuples containing the title and artist of each song.
+        bytes: The HTML of the chart page.
     '''
+    path = os.path.join(BILLBOARD_CACHE_DIR, str(date) + ".html.gz")
+    if os.path.exists(path) and http_client.HTTP_MODE != "record":
+        metrics.increment("billboard.cache_hits")
+        with gzip.open(path, "rb") as file:
+            return file.read()
+    metrics.increment("billboard.cache_misses")
+
     url = "https://www.billboard.com/charts/hot-100/" + str(date) + "/"
-    html = requests.get(url)
-    soup = BeautifulSoup(html.content, "html.parser")
+    html = http_client.get(url)
+
+    if html.status_code == 200 and date < http_client.getToday() and parseBillboard(html.content):
+        os.makedirs(BILLBOARD_CACHE_DIR, exist_ok=True)
+        with gzip.open(path + ".tmp", "wb") as file:
+            file.write(html.content)
+        os.replace(path + ".tmp", path)
+    return html.content
 
-    ul = soup.findAll("ul", class_="o-chart-results-list-row")
+def parseBillboard(html):
+    '''Parse the title and artist of each song from a Billboard Hot 100 chart page.'''
+    # Match the class among the element's other classes
+    rows = SoupStrainer("ul", class_=lambda c: c is not None and "o-chart-results-list-row" in c.split())
+    soup = BeautifulSoup(html, BILLBOARD_PARSER, parse_only=rows)
+
+    # Only the chart rows were parsed, and they are all top-level
+    ul = soup.find_all("ul", recursive=False)
 
     billboard = []
     for i in ul:
@@ -76,230 +112,453 @@ def scrapeBillboard(date):
 
     return billboard
 
+def scrapeBillboard(date):
+    '''
+    Scrape the Billboard Hot 100 chart for a given date.
+    
+    Parameters:
+        date (datetime.date): The date of the chart.
+        
+    Returns:
+        list: A list of tuples containing the title and artist of each song.
+    '''
+    with metrics.span("ingest.billboard"):
+        return parseBillboard(fetchBillboardPage(date))
+
+def scrapeBillboardWeeks(dates, workers=1):
+    '''
+    Scrape the Billboard Hot 100 charts for several dates in parallel.
+
+    Parameters:
+        dates (list): The dates of the charts.
+        workers (int): The number of charts fetched concurrently.
+
+    Returns:
+        list: The songs of all charts, in the order of the dates.
+    '''
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        charts = list(pool.map(scrapeBillboard, dates))
+    return [song for chart in charts for song in chart]
+
 
 # Spotify API
 
-def getSpotifyToken():
-    '''Get the Spotify access token.'''
-    response = requests.post(
-        "https://accounts.spotify.com/api/token",
-        data={
-        "grant_type": "client_credentials",
-        "client_id": spotify_cid,
-        "client_secret": spotify_secret,
-    }).json()
-
-    return response["access_token"]
-
-def getSpotifyID(token, title, artist):
-    '''Get the Spotify ID of a song.'''
-    headers = {"Authorization": "Bearer " + token}
+# Maximum number of IDs per audio-features request
+SPOTIFY_BATCH_SIZE = 100
+
+spotify_token = None
+spotify_token_expires = 0
+spotify_token_lock = threading.Lock()
+
+def getSpotifyToken(stale_token=None):
+    '''
+    Get the Spotify access token, reusing it until shortly before it expires.
+
+    Parameters:
+        stale_token (str): A token the API rejected. It is refreshed unless
+            another thread has already replaced it.
+
+    Returns:
+        str: The access token.
+    '''
+    global spotify_token
+    global spotify_token_expires
+
+    with spotify_token_lock:
+        expired = time.time() >= spotify_token_expires - 60
+        if spotify_token is None or expired or spotify_token == stale_token:
+            response = http_client.post(
+                "https://accounts.spotify.com/api/token",
+                data={
+                "grant_type": "client_credentials",
+                "client_id": spotify_cid,
+                "client_secret": spotify_secret,
+            })
+            response.raise_for_status()
+            response = response.json()
+            spotify_token = response["access_token"]
+            spotify_token_expires = time.time() + response.get("expires_in", 3600)
+        return spotify_token
+
+def spotifyGet(url):
+    '''
+    Send a GET request to the Spotify API, refreshing the token once on 401.
+
+    Raises:
+        requests.RequestException: If the request failed or returned an error status.
+    '''
+    token = getSpotifyToken()
+    response = http_client.get(url, headers={"Authorization": "Bearer " + token})
+    if response.status_code == 401:
+        metrics.increment("spotify.token_retries")
+        token = getSpotifyToken(stale_token=token)
+        response = http_client.get(url, headers={"Authorization": "Bearer " + token})
+    response.raise_for_status()
+    return response.json()
+
+def getSpotifyID(title, artist):
+    '''Get the Spotify ID of a song, or None if the search finds nothing.'''
     url = f"https://api.spotify.com/v1/search?q={title}%20{artist}&type=track&market=US&limit=1"
-    response = requests.get(url, headers=headers).json()
-    return response["tracks"]["items"][0]["id"]
+    items = spotifyGet(url)["tracks"]["items"]
+    return items[0]["id"] if items else None
 
-def getSpotifyFeatures(token, song_id):
+def getSpotifyFeatures(song_id):
     '''Get the Spotify features of a song.'''
-    headers = {"Authorization": "Bearer " + token}
     url = f"https://api.spotify.com/v1/audio-features/{song_id}"
-    response = requests.get(url, headers=headers)
-    return response.json()
+    return spotifyGet(url)
+
+def getSpotifyFeaturesBulk(song_ids):
+    '''
+    Get the Spotify features of many songs, up to SPOTIFY_BATCH_SIZE per request.
+
+    Parameters:
+        song_ids (list): The Spotify IDs of the songs.
+
+    Returns:
+        dict: The features of each song by Spotify ID. Songs without features are left out.
+    '''
+    features = {}
+    for i in range(0, len(song_ids), SPOTIFY_BATCH_SIZE):
+        batch = song_ids[i:i + SPOTIFY_BATCH_SIZE]
+        url = "https://api.spotify.com/v1/audio-features?ids=" + ",".join(batch)
+        for item in spotifyGet(url)["audio_features"]:
+            if item:
+                features[item["id"]] = item
+    return features
 
 
 # Genius API
 
+# Statuses meaning the song or its page is gone for good, unlike throttling,
+# server errors or rejected credentials, which leave the song pending
+NOT_FOUND_STATUSES = {404, 410}
+
 def getGeniusURL(title, artist):
-    '''Get the Genius URL of a song.'''
+    '''Get the Genius URL of a song, or None if the search finds nothing.'''
     url = "https://api.genius.com/search"
     params = {"q": f"{title} {artist}"}
-    response = requests.get(url, params=params, headers=headers).json()
-    return response["response"]["hits"][0]["result"]["url"]
+    response = http_client.get(url, params=params, headers=headers)
+    if response.status_code in NOT_FOUND_STATUSES:
+        return None
+    response.raise_for_status()
+    hits = response.json()["response"]["hits"]
+    return hits[0]["result"]["url"] if hits else None
 
 def getLyrics(url):
-    '''Get the lyrics of a song from its Genius URL.'''
-    html = requests.get(url)
+    '''Get the lyrics of a song from its Genius URL, or None if the page is gone or has none.'''
+    html = http_client.get(url)
+    if html.status_code in NOT_FOUND_STATUSES:
+        return None
+    html.raise_for_status()
     soup = BeautifulSoup(html.content, "html.parser")
-    lyrics = soup.find("div", {"data-lyrics-container": "true"}).get_text(separator="\n") 
-    return lyrics
-
-
-# Readability metrics
-
-def countSyllables(word):
-    '''Count the number of syllables in a word.'''
-    count = 0
-    vowels = 'aeiouy'
-    word = word.lower().strip(".:;?!")
-    if word[0] in vowels:
-        count +=1
-    for index in range(1, len(word)):
-        if word[index] in vowels and word[index-1] not in vowels:
-            count +=1
-    if word.endswith('e'):
-        count -= 1
-    if word.endswith('le'):
-        count += 1
-    if count == 0:
-        count +=1
-    return count
-
-def getFRES(lyrics):
-    '''Calculate the Flesch reading-ease score (FRES) of a song.'''
-    # Remove [Verse], [Chorus], etc.
-    lyrics = re.sub(r"\[.*\]", "", lyrics)
-    sentence = lyrics.split("\n")
-    sentence = [i for i in sentence if i]
-    word = lyrics.split()
-    word_count = len(word)
-    sentence_count = len(sentence)
-    syllable_count = sum([countSyllables(token) for token in word])
-    return 206.835 - (1.015 * (word_count / sentence_count)) - (84.6 * (syllable_count / word_count))
-
-
-def vocabComplex(lyrics):
-    '''Calculate the ratio of different unique word stems (types) to the total number of words (tokens).'''
-    tokens = nltk.word_tokenize(lyrics.lower())
-    return len(set(tokens)) / len(tokens)
-
-
-def sentenceLength(lyrics):
-    '''Calculate the average number of words in a sentence.'''
-    sentences = nltk.sent_tokenize(lyrics)
-    total_words = sum(len(nltk.word_tokenize(sent)) for sent in sentences)
-    return total_words / len(sentences)
-
-
-def avgSyllable(lyrics):
-    """Calculate the average number of syllables per word."""
-    d = cmudict.dict()
-    words = lyrics.split()
-    total_syllables = sum(len(d[word.lower()][0]) for word in words if word.lower() in d)
-    return total_syllables / len(words)
+    container = soup.find("div", {"data-lyrics-container": "true"})
+    return None if container is None else container.get_text(separator="\n")
 
 
 # Data consolidation
 
 
-def addAllFeatures(dataset, billboard):
+def addLyricsFeatures(features, title, artist):
+    '''
+    Add the Genius lyrics and readability metrics to the Spotify features of a song.
+
+    Parameters:
+        features (dict): The Spotify features of the song.
+        title (str): The title of the song.
+        artist (str): The artist of the song.
+
+    Returns:
+        dict: The features of the song including lyrics, or None if the song
+            or its lyrics are not on Genius.
+    '''
+    with metrics.span("ingest.genius_search"):
+        genius_url = getGeniusURL(title, artist)
+    if genius_url is None:
+        return None
+    with metrics.span("ingest.genius_lyrics"):
+        lyrics = getLyrics(genius_url)
+    if lyrics is None:
+        return None
+    with metrics.span("ingest.readability"):
+        features.update(analyzeLyrics(lyrics))
+    features["lyrics"] = lyrics
+    features["title"] = title.replace("_", " ")
+    features["artist"] = artist.replace("_", " ")
+    features["lang"] = detect(lyrics)
+    return features
+
+
+def addAllFeatures(store, billboard, workers=1):
     '''
-    Add new songs on the Billboard Hot 100 to the dataset with all features including lyrics.
+    Add new songs on the Billboard Hot 100 to the store with all features including lyrics.
+
+    Spotify IDs are resolved first so that audio features can be fetched in
+    bulk, then the Genius lyrics are fetched song by song. Each song is saved
+    as soon as it is complete, so an interrupted run keeps its progress.
+    Songs that are not found are dropped, while songs whose requests failed,
+    e.g. were still throttled after http_client's retries, stay pending for
+    the next run. The Spotify token is fetched before any song, so bad
+    credentials abort the run instead of failing every song.
 
     Parameters:
-        dataset (dict): The dataset.
+        store (SongStore): The song store.
         billboard (list): The list of songs on the Billboard Hot 100.
+        workers (int): The number of songs fetched concurrently. Requests per
+            service are further bounded by http_client.SERVICE_LIMITS.
         
     Returns:
-        dict: The dataset with lyrics.
+        SongStore: The store with the new songs.
     '''
-    spotify_token = getSpotifyToken()
-
+    # Skip songs already in the store
+    songs = {}
     for title, artist in billboard:
-        
-        # Skip if the song is already in the dataset
         abbrev = title.replace("_", " ") + "_" + artist.replace("_", " ")
-        if abbrev in dataset["data"]:
+        if abbrev in songs:
             continue
-
-        try:
-            # Get the Spotify features, Genius lyrics, and FRES
-            print("Running: ", abbrev)
-            spotify_id = getSpotifyID(spotify_token, title, artist)
-            features = getSpotifyFeatures(getSpotifyToken(), spotify_id)
-            genius_url = getGeniusURL(title, artist)
-            lyrics = getLyrics(genius_url)
-            features["fres"] = getFRES(lyrics)
-            features["vocabComplex"] = vocabComplex(lyrics)
-            features["sentenceLength"] = sentenceLength(lyrics)
-            features["avgSyllable"] = avgSyllable(lyrics)
-            features["lyrics"] = lyrics
-            features["title"] = title.replace("_", " ")
-            features["artist"] = artist.replace("_", " ")
-            features["lang"] = detect(lyrics)
-        except:
-            # Skip if the song is not found on Spotify or Genius
-            print("Not found: ", abbrev)
+        if store.hasSong(abbrev):
+            store.dropPending(abbrev)
             continue
+        songs[abbrev] = (title, artist)
 
-        # Add the song with features to the dataset
-        dataset["data"][abbrev] = features
-    return dataset
+    def run(fetch, items):
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                yield from pool.map(fetch, items)
+        else:
+            yield from map(fetch, items)
 
+    # Songs whose requests failed say nothing about whether the song exists,
+    # so they stay pending for the next run
+    retry_later = set()
 
-def updateCache():
-    '''Update the dataset with new songs on the Billboard Hot 100.'''
+    def retryLater(abbrev, error):
+        print(f"Retry later:  {abbrev} ({error})")
+        metrics.increment("ingest.retry_later")
+        retry_later.add(abbrev)
 
-    dataset = openCache()
+    def fetchID(abbrev):
+        try:
+            print(f"Running:  {abbrev}")
+            with metrics.span("ingest.spotify_id"):
+                spotify_id = getSpotifyID(*songs[abbrev])
+        except (requests.RequestException, KeyError) as error:
+            retryLater(abbrev, error)
+            return None
+        if spotify_id is None:
+            # Skip if the song is not found on Spotify
+            print(f"Not found:  {abbrev}")
+            metrics.increment("ingest.not_found.spotify")
+        return spotify_id
+
+    def fetchLyrics(abbrev):
+        try:
+            # Get the Genius lyrics, and FRES
+            features = addLyricsFeatures(dict(spotify_features[abbrev]), *songs[abbrev])
+        except (requests.RequestException, KeyError) as error:
+            # Includes songs missing from the archive being replayed
+            retryLater(abbrev, error)
+            return None
+        except Exception as error:
+            # Skip if the lyrics cannot be analyzed, e.g. their language is not detected
+            print(f"Unusable lyrics:  {abbrev} ({error})")
+            metrics.increment("ingest.unusable_lyrics")
+            return None
+        if features is None:
+            # Skip if the song is not found on Genius
+            print(f"Not found:  {abbrev}")
+            metrics.increment("ingest.not_found.genius")
+        return features
+
+    start = time.time()
+
+    if songs:
+        # Fail here rather than once per song if the credentials are rejected
+        getSpotifyToken()
+    spotify_ids = dict(zip(songs, run(fetchID, songs)))
+    ids = list(dict.fromkeys(i for i in spotify_ids.values() if i is not None))
+    batches = [ids[i:i + SPOTIFY_BATCH_SIZE] for i in range(0, len(ids), SPOTIFY_BATCH_SIZE)]
+    features_by_id = {}
+    failed_ids = set()
+
+    def fetchFeatures(batch):
+        try:
+            with metrics.span("ingest.spotify_features", songs=len(batch)):
+                return getSpotifyFeaturesBulk(batch)
+        except (requests.RequestException, KeyError, TypeError) as error:
+            # An error status or body fails only this batch; its songs stay pending
+            print(f"Audio features failed for {len(batch)} songs ({error})")
+            failed_ids.update(batch)
+            return {}
+
+    for batch_features in run(fetchFeatures, batches):
+        features_by_id.update(batch_features)
+
+    spotify_features = {}
+    for abbrev, spotify_id in spotify_ids.items():
+        if spotify_id in features_by_id:
+            spotify_features[abbrev] = features_by_id[spotify_id]
+        elif spotify_id in failed_ids:
+            retryLater(abbrev, "audio features failed")
+        elif abbrev not in retry_later:
+            if spotify_id is not None:
+                print(f"Not found:  {abbrev}")
+                metrics.increment("ingest.not_found.spotify_features")
+            store.dropPending(abbrev)
+
+    # Save the songs with features in Billboard order as they complete
+    for abbrev, features in zip(spotify_features, run(fetchLyrics, list(spotify_features))):
+        if features is not None:
+            store.saveSong(abbrev, features)
+            metrics.increment("ingest.saved")
+        elif abbrev not in retry_later:
+            store.dropPending(abbrev)
+
+    elapsed = time.time() - start
+    if songs:
+        print(f"Processed {len(songs)} songs in {elapsed:.1f}s ({len(songs) / elapsed:.2f} songs/s)")
+    if retry_later:
+        print(f"{len(retry_later)} songs failed and stay pending for the next run")
+    return store
+
+
+def updateCache(workers=WORKERS):
+    '''
+    Update the dataset with new songs on the Billboard Hot 100.
+
+    Songs left pending by an interrupted run are fetched first.
+    '''
+
+    store = openCache()
     # Billboard Hot 100 is updated every Saturday
-    today = datetime.today().date()
+    today = http_client.getToday()
     saturday = today + timedelta(days=5-today.weekday())
+    last_updated = store.getMeta("updated_week")
 
     # If cache is empty, add all songs on the Billboard Hot 100 from the past year to the dataset
-    if dataset == {}:
-        dataset["updated_week"] = str(saturday)
-        dataset["data"] = {}
-        billboard = []
+    if last_updated is None:
+        dates = [saturday - timedelta(days=7 * i) for i in range(52)]
 
-        for i in range(52):
-            billboard.extend(scrapeBillboard(saturday))
-            saturday -= timedelta(days=7)
+    # If cache is not empty, check if the dataset is up to date
+    # If not, updated new songs from the last updated week to the current week to the dataset
+    elif last_updated != str(saturday):
+        dates = []
+        week = saturday
 
+        while str(week) != last_updated:
+            dates.append(week)
+            week -= timedelta(days=7)
+
+    else:
+        dates = []
+
+    if dates:
+        billboard = scrapeBillboardWeeks(dates, workers)
         billboard = list(set(billboard))
-        dataset = addAllFeatures(dataset, billboard)
-        saveCache(dataset)
-    
-    # If cache is not empty, check if the dataset is up to date
+        store.addPending(billboard, updated_week=str(saturday))
+
+    pending = store.getPending()
+    if pending:
+        addAllFeatures(store, pending, workers)
+        metrics.write_snapshot(METRICS_FILENAME)
     else:
-        # If not, updated new songs from the last updated week to the current week to the dataset
-        if dataset["updated_week"] != str(saturday):
-            last_updated = dataset["updated_week"]
-            dataset["updated_week"] = str(saturday)
-            billboard = []
-
-            while str(saturday) != last_updated:
-                billboard.extend(scrapeBillboard(saturday))
-                saturday -= timedelta(days=7)
-
-            billboard = list(set(billboard))
-            dataset = addAllFeatures(dataset, billboard)
-            saveCache(dataset)
-        else:
-            print("Dataset is up to date.")
+        print("Dataset is up to date.")
+
+    print("Data retrieved: ", store.countSongs())
+    print("Data sample: ", store.getSong("Houdini_Dua Lipa"))
+    store.close()
+
+
+def updateLevels(filename=LEVELS_FILENAME):
+    '''
+    Fold the songs added since the last run into the stored level cutoffs.
+
+    The cutoffs are computed exactly the first time; afterwards new songs only
+    update their quantile sketches, so existing songs keep their levels unless
+    re-binned with levels.py.
+    '''
+    store = openCache()
+    levels = load_levels(filename)
+    last_rowid = store.lastRowid()
 
-    print("Data retrieved: ", len(dataset["data"]))
-    print("Data sample: ", dataset["data"]["Houdini_Dua Lipa"])
+    if levels is None:
+        songs = pd.DataFrame([features for song, features in store.iterSongs()])
+        levels = compute_levels(songs)
+    else:
+        songs = pd.DataFrame([features for song, features in store.iterSongs(after=levels.get("store_rowid", 0))])
+        levels = update_levels(levels, songs)
+
+    levels["store_rowid"] = last_rowid
+    save_levels(levels, filename)
+    store.close()
+
+
+def writeData(songs, filename="data.json"):
+    '''
+    Write songs to a JSON file as they are produced, replacing the file only once complete.
+
+    Parameters:
+        songs (iterable): The songs to write, as dicts.
+        filename (str): The file to write.
+    '''
+    tmp_filename = filename + ".tmp"
+
+    with open(tmp_filename, "w") as file:
+        file.write("[")
+        i = -1
+        for i, song in enumerate(songs):
+            file.write("," if i else "")
+            file.write("\n" + textwrap.indent(json.dumps(song, indent=4), "    "))
+        file.write("\n]" if i >= 0 else "]")
+
+    os.replace(tmp_filename, filename)
 
 
 def exportData():
-    '''Export the dataset to a JSON file.'''
-    
-    dataset = openCache()
-    data = dataset["data"]
+    '''Export the dataset to a JSON file, streaming the songs from the store.'''
     
+    store = openCache()
+
     # Prepare data by selecting only specific attributes for each song
-    filtered_data = []
-    for song in data:
-        features = data[song]
-        filtered_data.append({
-            "id": features['id'],
-            "title": features['title'],
-            "artist": features['artist'],
-            "danceability": features['danceability'],
-            "valence": features['valence'],
-            "speechiness": features['speechiness'],
-            "fres": features['fres'],
-            "vocabComplex": features['vocabComplex'],
-            "sentenceLength": features['sentenceLength'],
-            "avgSyllable": features['avgSyllable'],
-            "lyrics": features['lyrics'],
-            "lang": features["lang"]
-        })
-    
+    filtered_data = ({
+        "id": features['id'],
+        "title": features['title'],
+        "artist": features['artist'],
+        "danceability": features['danceability'],
+        "valence": features['valence'],
+        "speechiness": features['speechiness'],
+        "fres": features['fres'],
+        "vocabComplex": features['vocabComplex'],
+        "sentenceLength": features['sentenceLength'],
+        "avgSyllable": features['avgSyllable'],
+        "lyrics": features['lyrics'],
+        "lang": features["lang"]
+    } for song, features in store.iterSongs())
+
     # Export the filtered data to a JSON file
-    with open("data.json", "w") as file:
-        json.dump(filtered_data, file, indent=4)
+    writeData(filtered_data, "data.json")
+    store.close()
+
+
+def exportCatalog():
+    '''Export the dataset as a columnar catalog with the lyrics in a separate blob.'''
+    from catalog import write_catalog
+
+    store = openCache()
+    write_catalog((features for song, features in store.iterSongs()), "data.parquet")
+    store.close()
+
+
+def exportLyricsIndex():
+    '''Build the inverted index over the lyrics of the exported data.json.'''
+    from lyrics_index import build_lyrics_index
+
+    build_lyrics_index("data.json", "lyrics_index.npz")
 
 
 if __name__ == "__main__":
     init()
     updateCache()
-    exportData()
\ No newline at end of file
+    updateLevels()
+    exportData()
+    exportCatalog()
+    exportLyricsIndex()
\ No newline at end of file
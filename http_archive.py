@@ -0,0 +1,101 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+from datetime import date
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+ARCHIVE_FILENAME = "http_archive.db"
+
+# Form fields holding credentials; they are left out of request keys so that
+# an archive can be replayed without the credentials it was recorded with
+SECRET_FIELDS = {"client_id", "client_secret"}
+
+# The only response headers the fetchers look at
+KEPT_HEADERS = ["Content-Type", "Retry-After"]
+
+
+def requestKey(method, url, params=None, data=None):
+    '''
+    Get the key of a request in the archive: a hash of its method, full URL
+    and body, without credentials or headers.
+
+    Parameters:
+        method (str): The HTTP method.
+        url (str): The URL.
+        params (dict): The query parameters.
+        data (dict): The form fields.
+
+    Returns:
+        str: The key.
+    '''
+    if isinstance(data, dict):
+        data = {name: value for name, value in data.items() if name not in SECRET_FIELDS}
+    prepared = requests.Request(method, url, params=params, data=data).prepare()
+    body = prepared.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha256(method.encode("utf-8") + b"\0" + prepared.url.encode("utf-8") + b"\0" + body).hexdigest()
+
+
+class HttpArchive:
+    '''
+    A SQLite archive of HTTP responses with zlib-compressed bodies, written
+    while recording and read while replaying an ingest run.
+    '''
+
+    def __init__(self, path=ARCHIVE_FILENAME):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, method TEXT, url TEXT, status INTEGER, headers TEXT, body BLOB)"
+            )
+
+    def close(self):
+        '''Close the connection to the archive.'''
+        self.conn.close()
+
+    def getRecordedOn(self):
+        '''Get the day the archive was first recorded, or None for an empty archive.'''
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'recorded_on'").fetchone()
+        return None if row is None else date.fromisoformat(row[0])
+
+    def saveResponse(self, key, method, url, response):
+        '''Save a response under the key of its request, replacing an older one.'''
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('recorded_on', ?)", (date.today().isoformat(),)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, method, url, response.status_code, json.dumps(headers), zlib.compress(response.content, 6)),
+            )
+
+    def getResponse(self, key):
+        '''Get the saved response of a request as a requests.Response, or None if it was not recorded.'''
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT url, status, headers, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        url, status, headers, body = row
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = zlib.decompress(body)
+        return response
@@ -0,0 +1,348 @@
+import os
+import random
+import threading
+import time
+from datetime import date
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+# Maximum number of requests in flight per service
+SERVICE_LIMITS = {"spotify": 8, "genius": 8, "billboard": 4}
+
+DEFAULT_LIMIT = 4
+
+HOST_SERVICES = {
+    "accounts.spotify.com": "spotify",
+    "api.spotify.com": "spotify",
+    "api.genius.com": "genius",
+    "genius.com": "genius",
+    "www.billboard.com": "billboard",
+}
+
+# Highest sustained requests per second per service; the actual rate backs
+# off from here when a service throttles and creeps back once it stops
+SERVICE_RATES = {"spotify": 10.0, "genius": 5.0, "billboard": 2.0}
+
+DEFAULT_RATE = 2.0
+MIN_RATE = 0.2
+# Multiplicative decrease on a throttled or failed request, additive increase on success
+RATE_DECREASE = 0.5
+RATE_INCREASE = 0.1
+
+# Responses and errors that are retried, with jittered exponential backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Longest Retry-After that is honoured as is
+MAX_RETRY_AFTER = 600.0
+
+TIMEOUT = 30
+
+# "live" sends every request; "record" also saves every response to the
+# archive; "replay" serves responses from the archive without any network,
+# after an optional artificial latency in seconds
+HTTP_MODE = os.getenv("HTTP_MODE", "live")
+HTTP_ARCHIVE = os.getenv("HTTP_ARCHIVE", "http_archive.db")
+REPLAY_LATENCY = float(os.getenv("HTTP_REPLAY_LATENCY", "0"))
+
+_lock = threading.Lock()
+_sessions = {}
+_semaphores = {}
+_buckets = {}
+_archive = None
+
+
+class TransientError(requests.RequestException):
+    '''
+    A request that still failed with a throttling or server error after all
+    retries. Unlike a 404 or an empty search result, it says nothing about
+    whether the song exists, so it is worth trying again later.
+    '''
+
+
+class ReplayMissError(requests.RequestException):
+    '''
+    A request that was not recorded in the archive being replayed. Like any
+    failed request, it leaves the song pending rather than marking it as not
+    found.
+    '''
+
+
+class TokenBucket:
+    '''
+    An adaptive token bucket pacing the requests to one service.
+
+    Tokens refill at the current rate, with a burst of up to one second of
+    requests. Throttling halves the rate and pauses the whole service for its
+    Retry-After; every success raises the rate again by a small step, up to
+    the configured maximum.
+    '''
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Wait until a request may be sent.'''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def onSuccess(self):
+        '''Raise the rate after a successful request.'''
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def onThrottled(self, retry_after=None):
+        '''Lower the rate after a throttled or failed request, pausing for retry_after seconds.'''
+        with self.lock:
+            self.rate = max(MIN_RATE, self.rate * RATE_DECREASE)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after is not None:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+def setServiceLimits(**limits):
+    '''Change the per-service concurrency limits, e.g. setServiceLimits(genius=4).'''
+    with _lock:
+        SERVICE_LIMITS.update(limits)
+        for service in limits:
+            _semaphores.pop(service, None)
+        _sessions.clear()
+
+
+def setServiceRates(**rates):
+    '''Change the per-service maximum request rates, e.g. setServiceRates(genius=2).'''
+    with _lock:
+        SERVICE_RATES.update(rates)
+        for service in rates:
+            _buckets.pop(service, None)
+
+
+def setMode(mode, archive=None, latency=None):
+    '''
+    Switch between sending requests live, recording them and replaying them.
+
+    Parameters:
+        mode (str): "live", "record" or "replay".
+        archive (str): The archive file; defaults to HTTP_ARCHIVE.
+        latency (float): Seconds added to every replayed request.
+    '''
+    global HTTP_MODE, HTTP_ARCHIVE, REPLAY_LATENCY, _archive
+    if mode not in ("live", "record", "replay"):
+        raise ValueError(f"Unknown HTTP mode: {mode}")
+    with _lock:
+        HTTP_MODE = mode
+        if archive is not None and archive != HTTP_ARCHIVE:
+            HTTP_ARCHIVE = archive
+            if _archive is not None:
+                _archive.close()
+            _archive = None
+        if latency is not None:
+            REPLAY_LATENCY = latency
+
+
+def getArchive():
+    '''Get the archive that requests are recorded to or replayed from.'''
+    global _archive
+    with _lock:
+        if _archive is None:
+            from http_archive import HttpArchive
+
+            _archive = HttpArchive(HTTP_ARCHIVE)
+        return _archive
+
+
+def getToday():
+    '''
+    Get today's date, or the day the archive was recorded when replaying, so
+    that a replay asks for the same Billboard charts as the recording did.
+    '''
+    if HTTP_MODE == "replay":
+        recorded_on = getArchive().getRecordedOn()
+        if recorded_on is not None:
+            return recorded_on
+    return date.today()
+
+
+def getService(host):
+    '''Get the service a host belongs to; unknown hosts are their own service.'''
+    return HOST_SERVICES.get(host, host)
+
+
+def getSession(host):
+    '''Get the shared keep-alive session for a host.'''
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            pool_size = SERVICE_LIMITS.get(getService(host), DEFAULT_LIMIT)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def getSemaphore(service):
+    '''Get the semaphore bounding the requests in flight to a service.'''
+    with _lock:
+        semaphore = _semaphores.get(service)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(SERVICE_LIMITS.get(service, DEFAULT_LIMIT))
+            _semaphores[service] = semaphore
+        return semaphore
+
+
+def getBucket(service):
+    '''Get the token bucket pacing the requests to a service.'''
+    with _lock:
+        bucket = _buckets.get(service)
+        if bucket is None:
+            bucket = TokenBucket(SERVICE_RATES.get(service, DEFAULT_RATE))
+            _buckets[service] = bucket
+        return bucket
+
+
+def getRetryAfter(response):
+    '''Get the seconds to wait from a Retry-After header, or None if there is none.'''
+    value = None if response is None else response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def getBackoff(attempt):
+    '''Get a random delay before retry number attempt + 1, growing exponentially (full jitter).'''
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, **kwargs):
+    '''
+    Send a request through the pooled session of its host, paced by the
+    service's token bucket and within the service's concurrency limit.
+
+    Throttling (429), server errors (5xx), timeouts and connection errors are
+    retried up to MAX_RETRIES times, after the Retry-After of the response or
+    a jittered exponential backoff. Any other response is returned as is.
+
+    The time spent waiting for a free slot and the request itself are recorded
+    as the metrics spans "http.<service>.wait" and "http.<service>", every
+    response status as the counter "http.<service>.<status>", and retries as
+    "http.<service>.retries".
+
+    In record mode the final response is also saved to the archive; in replay
+    mode it is served from the archive instead, see replayRequest().
+
+    Raises:
+        TransientError: If the request still failed after all retries.
+    '''
+    host = urlsplit(url).netloc
+    service = getService(host)
+    if HTTP_MODE == "replay":
+        return replayRequest(service, method, url, **kwargs)
+    kwargs.setdefault("timeout", TIMEOUT)
+    bucket = getBucket(service)
+    semaphore = getSemaphore(service)
+
+    for attempt in range(MAX_RETRIES + 1):
+        with metrics.span(f"http.{service}.wait"):
+            bucket.acquire()
+            semaphore.acquire()
+        response = error = None
+        try:
+            with metrics.span(f"http.{service}", method=method):
+                response = getSession(host).request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as exception:
+            error = exception
+        finally:
+            semaphore.release()
+
+        if response is not None:
+            metrics.increment(f"http.{service}.{response.status_code}")
+            if response.status_code not in RETRY_STATUSES:
+                bucket.onSuccess()
+                if HTTP_MODE == "record":
+                    from http_archive import requestKey
+
+                    key = requestKey(method, url, kwargs.get("params"), kwargs.get("data"))
+                    getArchive().saveResponse(key, method, url, response)
+                return response
+            error = f"HTTP {response.status_code}"
+
+        retry_after = getRetryAfter(response)
+        bucket.onThrottled(retry_after)
+        if attempt == MAX_RETRIES:
+            break
+        metrics.increment(f"http.{service}.retries")
+        time.sleep(retry_after if retry_after is not None else getBackoff(attempt))
+
+    raise TransientError(f"{method} {url} failed after {MAX_RETRIES} retries: {error}", response=response)
+
+
+def replayRequest(service, method, url, **kwargs):
+    '''
+    Serve a request from the archive, within the service's concurrency limit
+    and after REPLAY_LATENCY seconds, recording the same metrics as a live
+    request. Headers, credentials and the timeout play no part in matching.
+
+    Raises:
+        ReplayMissError: If the request was not recorded.
+    '''
+    from http_archive import requestKey
+
+    key = requestKey(method, url, kwargs.get("params"), kwargs.get("data"))
+    semaphore = getSemaphore(service)
+    with metrics.span(f"http.{service}.wait"):
+        semaphore.acquire()
+    try:
+        with metrics.span(f"http.{service}", method=method, replay=True):
+            if REPLAY_LATENCY > 0:
+                time.sleep(REPLAY_LATENCY)
+            response = getArchive().getResponse(key)
+    finally:
+        semaphore.release()
+
+    if response is None:
+        metrics.increment(f"http.{service}.replay_misses")
+        raise ReplayMissError(f"{method} {url} is not in {HTTP_ARCHIVE}")
+    metrics.increment(f"http.{service}.{response.status_code}")
+    return response
+
+
+def get(url, **kwargs):
+    '''Send a GET request.'''
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    '''Send a POST request.'''
+    return request("POST", url, **kwargs)
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+LEVELS_FILENAME = "levels.json"
+QUANTILES = [0.33, 0.66]
+
+# Columns binned into Low/Medium/High and into 1/2/3 difficulty points
+LEVEL_COLUMNS = ['danceability', 'valence']
+NUMERIC_LEVEL_COLUMNS = ['speechiness', 'fres', 'vocabComplex', 'avgSyllable']
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain and
+    Chlamtac, 1985): five markers, constant memory, one update per value.
+    """
+
+    def __init__(self, p, heights=None, positions=None, desired=None, buffer=None):
+        self.p = p
+        self.heights = heights
+        self.positions = positions
+        self.desired = desired
+        self.buffer = [] if buffer is None else buffer
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    @classmethod
+    def from_values(cls, p, values):
+        """Start a sketch from the values seen so far."""
+        values = np.sort(np.asarray(values, dtype=float))
+        values = values[~np.isnan(values)]
+        if len(values) < 5:
+            return cls(p, buffer=values.tolist())
+
+        n = len(values)
+        sketch = cls(p)
+        desired = [1 + (n - 1) * increment for increment in sketch.increments]
+        positions = [int(round(position)) for position in desired]
+        for i in range(1, 5):
+            positions[i] = max(positions[i], positions[i - 1] + 1)
+        for i in range(3, -1, -1):
+            positions[i] = min(positions[i], positions[i + 1] - 1)
+        sketch.heights = [float(np.quantile(values, increment)) for increment in sketch.increments]
+        sketch.positions = positions
+        sketch.desired = desired
+        return sketch
+
+    def add(self, x):
+        """Fold one value into the sketch."""
+        if self.heights is None:
+            self.buffer.append(float(x))
+            if len(self.buffer) == 5:
+                sketch = P2Quantile.from_values(self.p, self.buffer)
+                self.__dict__.update(sketch.__dict__)
+            return
+
+        q, n = self.heights, self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        """The current estimate of the quantile."""
+        if self.heights is None:
+            return float(np.quantile(self.buffer, self.p)) if self.buffer else float('nan')
+        return self.heights[2]
+
+    def to_dict(self):
+        return {'p': self.p, 'heights': self.heights, 'positions': self.positions,
+                'desired': self.desired, 'buffer': self.buffer}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state['p'], state['heights'], state['positions'], state['desired'], state['buffer'])
+
+
+def compute_levels(df):
+    """
+    Compute the exact 33% and 66% cutoffs of every binned column of df, the
+    same cutoffs process_data() derives with pd.cut, plus a quantile sketch
+    per cutoff for incremental updates.
+    """
+    levels = {'songs': len(df), 'columns': {}}
+    for column in LEVEL_COLUMNS + NUMERIC_LEVEL_COLUMNS:
+        levels['columns'][column] = _column_levels(df[column])
+    levels['columns']['difficulty'] = _column_levels(difficulty_points(df, levels))
+    return levels
+
+def _column_levels(values):
+    values = pd.Series(values, dtype=float)
+    return {
+        'cutoffs': [float(values.quantile(q)) for q in QUANTILES],
+        'sketches': [P2Quantile.from_values(q, values).to_dict() for q in QUANTILES],
+    }
+
+def update_levels(levels, songs):
+    """
+    Fold new songs into the quantile sketches and move the cutoffs to the new
+    estimates. Existing songs only change level if a cutoff moves past them.
+
+    Parameters:
+    - levels (dict): Levels from compute_levels() or load_levels().
+    - songs (DataFrame): The new songs.
+    """
+    if len(songs) == 0:
+        return levels
+    difficulty = difficulty_points(songs, levels)
+    for column, state in levels['columns'].items():
+        values = difficulty if column == 'difficulty' else songs[column]
+        sketches = [P2Quantile.from_dict(sketch) for sketch in state['sketches']]
+        for value in np.asarray(values, dtype=float):
+            if not np.isnan(value):
+                for sketch in sketches:
+                    sketch.add(value)
+        state['sketches'] = [sketch.to_dict() for sketch in sketches]
+        state['cutoffs'] = [sketch.value() for sketch in sketches]
+        if column == 'difficulty':
+            # Difficulty points are whole numbers, so snap the estimates to whole cutoffs
+            state['cutoffs'] = [float(round(cutoff)) for cutoff in state['cutoffs']]
+    levels['songs'] += len(songs)
+    return levels
+
+def level_codes(values, cutoffs):
+    """Bin values against stored cutoffs: 0 up to the first cutoff, 1 up to the second, else 2; -1 for NaN."""
+    values = np.asarray(values, dtype=float)
+    codes = np.searchsorted(np.asarray(cutoffs, dtype=float), values, side='left')
+    return np.where(np.isnan(values), -1, codes)
+
+def difficulty_points(df, levels):
+    """The sum of the 1-3 difficulty points of speechiness, fres, vocabComplex and avgSyllable."""
+    points = 0
+    for column in NUMERIC_LEVEL_COLUMNS:
+        points = points + level_codes(df[column], levels['columns'][column]['cutoffs']) + 1
+    return points
+
+def apply_levels(df, levels):
+    """Add the level columns of process_data() to df using stored cutoffs."""
+    labels = ['Low', 'Medium', 'High']
+    for column in LEVEL_COLUMNS:
+        codes = level_codes(df[column], levels['columns'][column]['cutoffs'])
+        df[column + '_level'] = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+    for column in NUMERIC_LEVEL_COLUMNS:
+        df[column + '_level'] = level_codes(df[column], levels['columns'][column]['cutoffs']) + 1
+
+    df['difficulty'] = difficulty_points(df, levels)
+
+    codes = level_codes(df['difficulty'], levels['columns']['difficulty']['cutoffs'])
+    df['difficulty_level'] = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+    return df
+
+def levels_path(data_path):
+    """The levels file stored next to a data.json or data.parquet."""
+    return os.path.join(os.path.dirname(data_path), LEVELS_FILENAME)
+
+def load_levels(path=LEVELS_FILENAME):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def save_levels(levels, path=LEVELS_FILENAME):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(levels, file)
+    os.replace(path + '.tmp', path)
+
+def rebin(data_path):
+    """Recompute exact cutoffs over the whole dataset, re-binning every song."""
+    if data_path.endswith('.parquet'):
+        from catalog import read_catalog
+
+        df, _ = read_catalog(data_path)
+    else:
+        df = pd.read_json(data_path)
+
+    path = levels_path(data_path)
+    previous = load_levels(path)
+    levels = compute_levels(df)
+    if previous is not None and 'store_rowid' in previous:
+        levels['store_rowid'] = previous['store_rowid']
+    save_levels(levels, path)
+    return levels
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute the level cutoffs and re-bin every song.')
+    parser.add_argument('data', nargs='?', default='data.json')
+    args = parser.parse_args()
+    levels = rebin(args.data)
+    print(f"Re-binned {levels['songs']} songs into {levels_path(args.data)}")
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import re
+import time
+from collections import Counter
+
+import numpy as np
+
+# nltk.download('stopwords')
+
+
+LYRICS_INDEX_FILENAME = "lyrics_index.npz"
+# Phrases are runs of up to this many words that neither start nor end with a stopword
+MAX_PHRASE_WORDS = 3
+
+# Vocal fillers that are as uninformative in lyrics as stopwords
+LYRIC_FILLERS = {"oh", "ooh", "ah", "yeah", "yea", "hey", "la", "na", "da", "uh", "woah", "whoa", "mm", "mmm", "ha"}
+
+WORD_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)*")
+
+
+def get_stopwords():
+    """
+    Returns the words left out of the word counts: NLTK's English stopwords and
+    common vocal fillers.
+
+    Returns:
+    - set: The stopwords in lowercase.
+    """
+    from nltk.corpus import stopwords
+
+    return set(stopwords.words("english")) | LYRIC_FILLERS
+
+
+def tokenize(lyrics):
+    """
+    Splits lyrics into lowercase words, keeping contractions such as "don't" whole.
+
+    Parameters:
+    - lyrics (str): The lyrics of a song.
+
+    Returns:
+    - list: The words in order.
+    """
+    return WORD_PATTERN.findall(lyrics.lower().replace("’", "'"))
+
+
+def count_terms(lyrics, stopwords, max_phrase_words=MAX_PHRASE_WORDS):
+    """
+    Counts the words and phrases of a song.
+
+    Parameters:
+    - lyrics (str): The lyrics of the song.
+    - stopwords (set): Words that are not counted and do not start or end a phrase.
+    - max_phrase_words (int): The longest phrase to count.
+
+    Returns:
+    - Counter: The number of times each word and phrase occurs. Phrases are
+      words joined by single spaces.
+    """
+    words = tokenize(lyrics)
+    counts = Counter(word for word in words if word not in stopwords)
+    for n in range(2, max_phrase_words + 1):
+        for i in range(len(words) - n + 1):
+            if words[i] not in stopwords and words[i + n - 1] not in stopwords:
+                counts[" ".join(words[i : i + n])] += 1
+    return counts
+
+
+class LyricsIndex:
+    """
+    An inverted index over the lyrics of every song, with a forward index of
+    each song's terms. Terms are words and short phrases, encoded as integer
+    ids; both indexes are flat integer arrays with an offset array per term or
+    song, so the whole index stays compact and every lookup is a slice.
+
+    The forward list of a song holds its words first and then its phrases,
+    each sorted by how often they occur.
+    """
+
+    def __init__(self, ids, terms, postings_offsets, postings_songs, postings_counts,
+                 forward_offsets, forward_words, forward_terms, forward_counts):
+        self.ids = list(ids)
+        self.terms = list(terms)
+        self.postings_offsets = postings_offsets
+        self.postings_songs = postings_songs
+        self.postings_counts = postings_counts
+        self.forward_offsets = forward_offsets
+        self.forward_words = forward_words
+        self.forward_terms = forward_terms
+        self.forward_counts = forward_counts
+        self._term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        self._song_positions = {}
+        for position, song_id in enumerate(self.ids):
+            self._song_positions.setdefault(song_id, position)
+
+    @classmethod
+    def build(cls, songs, stopwords=None, max_phrase_words=MAX_PHRASE_WORDS):
+        """
+        Indexes the lyrics of songs.
+
+        Parameters:
+        - songs (iterable of dict): Songs with an id and lyrics, as in data.json.
+        - stopwords (set): Words left out; defaults to get_stopwords().
+        - max_phrase_words (int): The longest phrase to index.
+
+        Returns:
+        - LyricsIndex: The index.
+        """
+        if stopwords is None:
+            stopwords = get_stopwords()
+
+        ids = []
+        term_ids = {}
+        song_terms = []
+        for song in songs:
+            ids.append(song["id"])
+            counts = count_terms(song["lyrics"], stopwords, max_phrase_words)
+            song_terms.append([(term_ids.setdefault(term, len(term_ids)), count) for term, count in counts.items()])
+
+        # Renumber the terms alphabetically so the term list can be saved and searched in order
+        terms = sorted(term_ids)
+        renumber = np.empty(len(terms), dtype=np.int32)
+        for term_id, term in enumerate(terms):
+            renumber[term_ids[term]] = term_id
+        is_phrase = np.array([" " in term for term in terms], dtype=bool)
+
+        lengths = np.array([len(pairs) for pairs in song_terms], dtype=np.int64)
+        forward_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        total = int(forward_offsets[-1])
+        songs_flat = np.repeat(np.arange(len(ids), dtype=np.int32), lengths)
+        terms_flat = renumber[np.fromiter((term_id for pairs in song_terms for term_id, _ in pairs), np.int32, total)]
+        counts_flat = np.fromiter((count for pairs in song_terms for _, count in pairs), np.int32, total)
+
+        # Forward index: per song, words before phrases, most frequent first
+        order = np.lexsort((terms_flat, -counts_flat, is_phrase[terms_flat], songs_flat))
+        forward_terms = terms_flat[order]
+        forward_counts = counts_flat[order]
+        forward_words = np.bincount(songs_flat[~is_phrase[terms_flat]], minlength=len(ids)).astype(np.int32)
+
+        # Inverted index: per term, the songs that use it most first
+        order = np.lexsort((songs_flat, -counts_flat, terms_flat))
+        postings_songs = songs_flat[order]
+        postings_counts = counts_flat[order]
+        postings_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(terms_flat, minlength=len(terms)))]
+        ).astype(np.int64)
+
+        return cls(ids, terms, postings_offsets, postings_songs, postings_counts,
+                   forward_offsets, forward_words, forward_terms, forward_counts)
+
+    def save(self, path=LYRICS_INDEX_FILENAME):
+        """
+        Saves the index as one .npz file, replacing the old one atomically.
+
+        Parameters:
+        - path (str): The file to write.
+        """
+        with open(path + ".tmp", "wb") as file:
+            np.savez(
+                file,
+                ids=np.frombuffer("\n".join(self.ids).encode("utf-8"), dtype=np.uint8),
+                terms=np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype=np.uint8),
+                postings_offsets=self.postings_offsets,
+                postings_songs=self.postings_songs,
+                postings_counts=self.postings_counts,
+                forward_offsets=self.forward_offsets,
+                forward_words=self.forward_words,
+                forward_terms=self.forward_terms,
+                forward_counts=self.forward_counts,
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=LYRICS_INDEX_FILENAME):
+        """
+        Loads a saved index.
+
+        Parameters:
+        - path (str): The file written by save().
+
+        Returns:
+        - LyricsIndex or None: The index, or None if it has not been built.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+
+        def split(name):
+            text = arrays.pop(name).tobytes().decode("utf-8")
+            return text.split("\n") if text else []
+
+        return cls(split("ids"), split("terms"), **arrays)
+
+    def postings(self, term):
+        """
+        Returns the postings of a word or phrase.
+
+        Parameters:
+        - term (str): A word or phrase, in any case.
+
+        Returns:
+        - tuple: The positions of the songs in ids and the count of the term in
+          each, the songs using the term most first.
+        """
+        term_id = self._term_ids.get(" ".join(tokenize(term)))
+        if term_id is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+        return self.postings_songs[start:end], self.postings_counts[start:end]
+
+    def top_terms(self, song_id, k=10, phrases=False):
+        """
+        Returns the most frequent words or phrases of a song, leaving out stopwords.
+
+        Parameters:
+        - song_id (str): The Spotify ID of the song.
+        - k (int): The number of terms to return.
+        - phrases (bool): Return phrases instead of single words.
+
+        Returns:
+        - list: Tuples of term and count, most frequent first.
+        """
+        song = self._song_positions[song_id]
+        start, end = self.forward_offsets[song], self.forward_offsets[song + 1]
+        split = start + self.forward_words[song]
+        start, end = (split, end) if phrases else (start, split)
+        end = min(end, start + k)
+        return [(self.terms[term_id], int(count))
+                for term_id, count in zip(self.forward_terms[start:end], self.forward_counts[start:end])]
+
+    def songs_with(self, term):
+        """
+        Returns the songs whose lyrics contain a word or phrase.
+
+        Parameters:
+        - term (str): A word or a phrase of up to MAX_PHRASE_WORDS words. A phrase
+          can only be found if it neither starts nor ends with a stopword.
+
+        Returns:
+        - list: Tuples of Spotify ID and count, the songs using the term most first.
+        """
+        songs, counts = self.postings(term)
+        return [(self.ids[song], int(count)) for song, count in zip(songs, counts)]
+
+
+def build_lyrics_index(data_path="data.json", path=LYRICS_INDEX_FILENAME):
+    """
+    Builds and saves the lyrics index of a data.json.
+
+    Parameters:
+    - data_path (str): The exported songs.
+    - path (str): The index file to write.
+
+    Returns:
+    - LyricsIndex: The index.
+    """
+    with open(data_path, "r") as file:
+        songs = json.load(file)
+    index = LyricsIndex.build(songs)
+    index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the inverted index over the lyrics.")
+    parser.add_argument("data", nargs="?", default="data.json")
+    parser.add_argument("--out", default=LYRICS_INDEX_FILENAME)
+    args = parser.parse_args()
+
+    start = time.time()
+    index = build_lyrics_index(args.data, args.out)
+    print(f"Indexed {len(index.ids)} songs and {len(index.terms)} terms into {args.out} in {time.time() - start:.1f}s")
@@ -0,0 +1,198 @@
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_FILENAME = "metrics.json"
+# schedule_snapshot() writes the snapshot at most once per this many seconds
+SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5"))
+
+# Latencies are counted in log-spaced buckets, four per doubling from 10us up,
+# so percentiles come out within about 20% at constant memory per span
+BUCKET_BASE_MS = 0.01
+BUCKETS_PER_DOUBLING = 4
+BUCKETS = 128
+
+# Every span is also logged as one JSON line at INFO level; set METRICS_LOG=1
+# to print them to stderr without configuring logging
+logger = logging.getLogger("metrics")
+if os.getenv("METRICS_LOG") and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_write_lock = threading.Lock()
+_scheduled = set()
+
+
+class _SpanStats:
+    __slots__ = ("count", "errors", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def percentile(self, q):
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                # The upper edge of the bucket, but never more than the slowest span
+                return min(BUCKET_BASE_MS * 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING), self.max)
+        return self.max
+
+
+def record(name, seconds, error=None, **fields):
+    """
+    Records one timed run of a stage.
+
+    Parameters:
+    - name (str): The stage, e.g. "chat.llm" or "http.spotify".
+    - seconds (float): How long it took.
+    - error (str): The exception type if the stage failed.
+    - fields: Extra fields for the log line.
+    """
+    ms = seconds * 1000
+    bucket = 0 if ms <= BUCKET_BASE_MS else int(math.log2(ms / BUCKET_BASE_MS) * BUCKETS_PER_DOUBLING)
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = _SpanStats()
+        stats.count += 1
+        stats.errors += error is not None
+        stats.total += ms
+        stats.max = max(stats.max, ms)
+        stats.buckets[min(bucket, BUCKETS - 1)] += 1
+
+    if logger.isEnabledFor(logging.INFO):
+        line = {"event": "span", "name": name, "ms": round(ms, 3), **fields}
+        if error is not None:
+            line["error"] = error
+        logger.info(json.dumps(line, default=str))
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Times the code in a with block as one run of a stage. Exceptions are counted
+    as errors of the stage and re-raised.
+
+    Parameters:
+    - name (str): The stage.
+    - fields: Extra fields for the log line.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        record(name, time.perf_counter() - start, error, **fields)
+
+
+def increment(name, value=1):
+    """
+    Adds to a counter such as "answer_cache.hits".
+
+    Parameters:
+    - name (str): The counter.
+    - value (int): The amount to add.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    """
+    Returns the metrics collected so far in this process.
+
+    Returns:
+    - dict: Per span the count, errors and latency statistics in milliseconds,
+      and the value of every counter.
+    """
+    with _lock:
+        spans = {
+            name: {
+                "count": stats.count,
+                "errors": stats.errors,
+                "total_ms": round(stats.total, 3),
+                "mean_ms": round(stats.total / stats.count, 3),
+                "p50_ms": round(stats.percentile(0.5), 3),
+                "p90_ms": round(stats.percentile(0.9), 3),
+                "p99_ms": round(stats.percentile(0.99), 3),
+                "max_ms": round(stats.max, 3),
+            }
+            for name, stats in sorted(_spans.items())
+        }
+        counters = dict(sorted(_counters.items()))
+    return {"time": time.time(), "pid": os.getpid(), "spans": spans, "counters": counters}
+
+
+def write_snapshot(path=METRICS_FILENAME):
+    """
+    Writes snapshot() as JSON, replacing the file atomically. Each write goes
+    through a temporary file of its own, so concurrent writers never clash.
+
+    Parameters:
+    - path (str): The file to write.
+    """
+    with _write_lock:
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                   dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(snapshot(), file, indent=4)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def schedule_snapshot(path=METRICS_FILENAME, delay=None):
+    """
+    Writes snapshot() to path on a background thread after a delay, unless a
+    write to it is already scheduled, so a busy app rewrites the file at most
+    once per delay and never while serving a request. Write errors are logged.
+
+    Parameters:
+    - path (str): The file to write.
+    - delay (float): Seconds to wait; defaults to SNAPSHOT_INTERVAL.
+    """
+    with _lock:
+        if path in _scheduled:
+            return
+        _scheduled.add(path)
+
+    def write():
+        with _lock:
+            _scheduled.discard(path)
+        try:
+            write_snapshot(path)
+        except OSError:
+            logger.warning("Could not write the metrics snapshot to %s", path, exc_info=True)
+
+    timer = threading.Timer(SNAPSHOT_INTERVAL if delay is None else delay, write)
+    timer.daemon = True
+    timer.start()
+
+
+def reset():
+    """Clears all spans and counters."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
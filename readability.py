@@ -0,0 +1,146 @@
+import functools
+import re
+import threading
+import nltk
+from nltk.corpus import cmudict
+from nltk.tokenize import NLTKWordTokenizer
+# nltk.download('punkt')
+# nltk.download('cmudict')
+
+
+# The tokenizer nltk.word_tokenize applies to each sentence
+word_tokenizer = NLTKWordTokenizer()
+# Section headers such as [Verse] or [Chorus], removed before scoring FRES
+SECTION_HEADER = re.compile(r"\[.*\]")
+
+pronunciation_lengths = None
+pronunciation_lock = threading.Lock()
+
+
+def getPronunciationLengths():
+    '''
+    Load the CMU pronunciation dictionary once per process.
+
+    Only the number of phones of the first pronunciation of each word is kept,
+    which is all avgSyllable needs.
+    '''
+    global pronunciation_lengths
+
+    with pronunciation_lock:
+        if pronunciation_lengths is None:
+            pronunciation_lengths = {word: len(prons[0]) for word, prons in cmudict.dict().items()}
+    return pronunciation_lengths
+
+
+@functools.lru_cache(maxsize=65536)
+def countSyllables(word):
+    '''Count the number of syllables in a word.'''
+    count = 0
+    vowels = 'aeiouy'
+    word = word.lower().strip(".:;?!")
+    if word[0] in vowels:
+        count +=1
+    for index in range(1, len(word)):
+        if word[index] in vowels and word[index-1] not in vowels:
+            count +=1
+    if word.endswith('e'):
+        count -= 1
+    if word.endswith('le'):
+        count += 1
+    if count == 0:
+        count +=1
+    return count
+
+
+def tokenizeSentences(lyrics):
+    '''
+    Split lyrics into sentences and each sentence into words, as nltk.word_tokenize does.
+
+    Returns:
+        tuple: The sentences, the sentences nltk re-splits each of them into,
+            and the words of each sentence.
+    '''
+    sentences = nltk.sent_tokenize(lyrics)
+    parts = [nltk.sent_tokenize(sent) for sent in sentences]
+    sentence_tokens = [[token for part in sent for token in word_tokenizer.tokenize(part)] for sent in parts]
+    return sentences, parts, sentence_tokens
+
+
+def getFRES(lyrics):
+    '''Calculate the Flesch reading-ease score (FRES) of a song.'''
+    # Remove [Verse], [Chorus], etc.
+    lyrics = SECTION_HEADER.sub("", lyrics)
+    sentence = lyrics.split("\n")
+    sentence = [i for i in sentence if i]
+    word = lyrics.split()
+    word_count = len(word)
+    sentence_count = len(sentence)
+    syllable_count = sum([countSyllables(token) for token in word])
+    return 206.835 - (1.015 * (word_count / sentence_count)) - (84.6 * (syllable_count / word_count))
+
+
+def vocabComplex(lyrics):
+    '''Calculate the ratio of different unique word stems (types) to the total number of words (tokens).'''
+    tokens = nltk.word_tokenize(lyrics.lower())
+    return len(set(tokens)) / len(tokens)
+
+
+def sentenceLength(lyrics):
+    '''Calculate the average number of words in a sentence.'''
+    sentences = nltk.sent_tokenize(lyrics)
+    total_words = sum(len(nltk.word_tokenize(sent)) for sent in sentences)
+    return total_words / len(sentences)
+
+
+def avgSyllable(lyrics):
+    """Calculate the average number of syllables per word."""
+    d = getPronunciationLengths()
+    words = lyrics.split()
+    total_syllables = sum(d.get(word.lower(), 0) for word in words)
+    return total_syllables / len(words)
+
+
+def analyzeLyrics(lyrics):
+    '''
+    Calculate all readability metrics of a song, tokenizing its lyrics only once.
+
+    The results are identical to calling getFRES, vocabComplex, sentenceLength
+    and avgSyllable one by one.
+
+    Returns:
+        dict: The fres, vocabComplex, sentenceLength and avgSyllable of the song.
+    '''
+    sentences, parts, sentence_tokens = tokenizeSentences(lyrics)
+    total_words = sum(len(sent) for sent in sentence_tokens)
+
+    # vocabComplex tokenizes the lowercased lyrics. Word tokenization ignores
+    # case, so unless lowercasing moves a sentence boundary those words are
+    # the lowercased words of the original sentences.
+    lower_sentences = nltk.sent_tokenize(lyrics.lower())
+    if all(len(sent) == 1 for sent in parts) and lower_sentences == [sent.lower() for sent in sentences]:
+        tokens = [token.lower() for sent in sentence_tokens for token in sent]
+    else:
+        tokens = nltk.word_tokenize(lyrics.lower())
+
+    # getFRES and avgSyllable split the same lines on whitespace, with and
+    # without section headers; a header never spans a line, so one pass over
+    # the lines serves both
+    d = getPronunciationLengths()
+    line_count = word_count = syllable_count = total_syllables = raw_word_count = 0
+    for line in lyrics.split("\n"):
+        words = line.split()
+        raw_word_count += len(words)
+        total_syllables += sum(d.get(word.lower(), 0) for word in words)
+        line = SECTION_HEADER.sub("", line) if "[" in line else line
+        if line:
+            line_count += 1
+            words = line.split()
+            word_count += len(words)
+            syllable_count += sum(countSyllables(word) for word in words)
+
+    return {
+        "fres": 206.835 - (1.015 * (word_count / line_count)) - (84.6 * (syllable_count / word_count)),
+        "vocabComplex": len(set(tokens)) / len(tokens),
+        "sentenceLength": total_words / len(sentences),
+        "avgSyllable": total_syllables / raw_word_count,
+    }
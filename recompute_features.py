@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from readability import analyzeLyrics, getPronunciationLengths
+
+
+# Number of songs sent to a worker process at once
+CHUNK_SIZE = 256
+
+
+def initWorker():
+    '''Load the pronunciation dictionary once per worker process.'''
+    getPronunciationLengths()
+
+
+def analyzeChunk(lyrics_chunk):
+    '''
+    Calculate the readability metrics of a chunk of lyrics.
+
+    Returns:
+        list: The metrics of each song, or None where they could not be calculated.
+    '''
+    results = []
+    for lyrics in lyrics_chunk:
+        try:
+            results.append(analyzeLyrics(lyrics))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def recomputeMetrics(lyrics, workers=None, chunk_size=CHUNK_SIZE):
+    '''
+    Calculate the readability metrics of many songs on a pool of processes.
+
+    Parameters:
+        lyrics (list): The lyrics of each song.
+        workers (int): The number of processes; defaults to the number of CPUs.
+        chunk_size (int): The number of songs per work unit.
+
+    Returns:
+        list: The metrics of each song in the same order, or None where they
+            could not be calculated.
+    '''
+    chunks = [lyrics[i:i + chunk_size] for i in range(0, len(lyrics), chunk_size)]
+    if workers == 1:
+        initWorker()
+        return [metrics for chunk in chunks for metrics in analyzeChunk(chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker) as pool:
+        return [metrics for results in pool.map(analyzeChunk, chunks) for metrics in results]
+
+
+def recomputeDataJSON(filename="data.json", workers=None):
+    '''
+    Recompute the readability metrics of every song in an exported data.json,
+    in place. A columnar catalog (data.parquet) next to it is exported again,
+    so the app, which prefers the catalog, sees the new metrics too, and the
+    stored level cutoffs (levels.json) next to it are recomputed, so songs are
+    not binned against the scale of the old metrics.
+    '''
+    from data_fetch import writeData
+    from levels import levels_path, rebin
+
+    with open(filename, "r") as file:
+        songs = json.load(file)
+
+    results = recomputeMetrics([song["lyrics"] for song in songs], workers)
+    for song, metrics in zip(songs, results):
+        if metrics is not None:
+            song.update(metrics)
+
+    writeData(songs, filename)
+
+    if os.path.exists(levels_path(filename)):
+        rebin(filename)
+        print(f"Re-binned the levels in {levels_path(filename)}")
+
+    catalog_path = os.path.join(os.path.dirname(filename), "data.parquet")
+    if os.path.exists(catalog_path):
+        from catalog import write_catalog
+
+        write_catalog(songs, catalog_path)
+    return sum(metrics is None for metrics in results)
+
+
+def recomputeStore(filename="cache.db", workers=None):
+    '''
+    Recompute the readability metrics of every song in the song store, in one
+    transaction, and the stored level cutoffs (levels.json) next to it.
+    '''
+    import pandas as pd
+
+    from levels import compute_levels, levels_path, load_levels, save_levels
+    from song_store import openStore
+
+    store = openStore(filename)
+    songs = list(store.iterSongs())
+
+    results = recomputeMetrics([features["lyrics"] for _, features in songs], workers)
+    updated = []
+    for (abbrev, features), metrics in zip(songs, results):
+        if metrics is not None:
+            features.update(metrics)
+            updated.append((abbrev, features))
+
+    store.saveSongs(updated)
+    store.close()
+
+    # As levels.rebin() does for an exported dataset
+    path = levels_path(filename)
+    previous = load_levels(path)
+    if previous is not None:
+        levels = compute_levels(pd.DataFrame([features for _, features in songs]))
+        if "store_rowid" in previous:
+            levels["store_rowid"] = previous["store_rowid"]
+        save_levels(levels, path)
+        print(f"Re-binned the levels in {path}")
+    return len(songs) - len(updated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute the readability metrics of all songs without any network access."
+    )
+    parser.add_argument("filename", nargs="?", default="data.json", help="data.json or the cache.db song store")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: CPU count)")
+    args = parser.parse_args()
+
+    start = time.time()
+    if os.path.splitext(args.filename)[1] == ".db":
+        failed = recomputeStore(args.filename, args.workers)
+    else:
+        failed = recomputeDataJSON(args.filename, args.workers)
+    print(f"Recomputed {args.filename} in {time.time() - start:.1f}s ({failed} songs kept their old metrics)")
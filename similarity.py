@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+# The song features that describe how a song sounds and how hard its lyrics are
+FEATURES = ['danceability', 'valence', 'speechiness', 'fres', 'vocabComplex', 'avgSyllable']
+
+
+class SimilarityIndex:
+    """
+    A KD-tree over the standardized features of every song, answering "songs
+    like this one" queries in logarithmic time. Every feature is scaled to zero
+    mean and unit variance so that each counts equally; missing values are
+    treated as the mean.
+
+    Parameters:
+    - df (DataFrame): The songs, with an id column and the FEATURES columns.
+    - features (list of str): The columns to compare songs by.
+    """
+
+    def __init__(self, df, features=FEATURES):
+        values = df[features].to_numpy(dtype=float)
+        self.features = features
+        self.mean = np.nanmean(values, axis=0) if len(values) else np.zeros(len(features))
+        self.std = np.nanstd(values, axis=0) if len(values) else np.ones(len(features))
+        self.std[~(self.std > 0)] = 1.0
+        self.vectors = self.standardize(values)
+        # Sliding-midpoint splits build several times faster and query just as fast
+        self.tree = cKDTree(self.vectors, balanced_tree=False, compact_nodes=False)
+        self.ids = df['id'].to_numpy()
+        self._index = pd.Index(self.ids)
+        if len(self.ids):
+            # Build the hash table of the IDs now rather than on the first query
+            self._index.get_loc(self.ids[0])
+
+    def standardize(self, values):
+        """
+        Scales raw feature values like the indexed songs.
+
+        Parameters:
+        - values (array-like): One feature vector, or one per row, in the order of features.
+
+        Returns:
+        - ndarray: The standardized vectors, with missing values at the mean.
+        """
+        vectors = (np.asarray(values, dtype=float) - self.mean) / self.std
+        return np.nan_to_num(vectors, nan=0.0)
+
+    def nearest_to(self, values, k=5):
+        """
+        Finds the songs nearest to raw feature vectors.
+
+        Parameters:
+        - values (array-like): One feature vector, or a batch with one per row.
+        - k (int): The number of songs to return per vector.
+
+        Returns:
+        - tuple: The row positions and the distances of the nearest songs, closest
+          first, shaped (k,) for one vector or (n, k) for a batch.
+        """
+        k = min(k, len(self.ids))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        distances, positions = self.tree.query(self.standardize(values), k=list(range(1, k + 1)), workers=-1)
+        return positions, distances
+
+    def nearest(self, song_id, k=5):
+        """
+        Finds the songs nearest to a song in the index, excluding the song itself.
+
+        Parameters:
+        - song_id (str): The Spotify ID of the song.
+        - k (int): The number of songs to return.
+
+        Returns:
+        - tuple: The row positions and the distances of the nearest songs, closest first.
+        """
+        own = self._index.get_loc(song_id)
+        if isinstance(own, slice):
+            own = np.arange(own.start, own.stop)
+        elif isinstance(own, np.ndarray):
+            own = np.flatnonzero(own)
+        else:
+            own = np.array([own])
+
+        # The song and its duplicates are among the closest matches, so ask for that many more
+        k = min(k, len(self.ids) - len(own))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        distances, positions = self.tree.query(self.vectors[own[0]], k=k + len(own), workers=-1)
+        keep = self.ids[positions] != song_id
+        return positions[keep][:k], distances[keep][:k]
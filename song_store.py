@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+STORE_FILENAME = "cache.db"
+
+
+class SongStore:
+    '''
+    A SQLite store of the fetched songs, replacing the monolithic cache.json.
+
+    Every song is upserted in its own transaction, so an interrupted ingest
+    keeps all songs fetched so far. Songs still to be fetched are kept in a
+    pending table so the next run resumes where the last one stopped.
+    '''
+
+    def __init__(self, path=STORE_FILENAME):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS songs (abbrev TEXT PRIMARY KEY, features TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pending (abbrev TEXT PRIMARY KEY, title TEXT, artist TEXT)")
+
+    def close(self):
+        '''Close the connection to the store.'''
+        self.conn.close()
+
+    # Metadata
+
+    def getMeta(self, key, default=None):
+        '''Get a metadata value such as "updated_week".'''
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def setMeta(self, key, value):
+        '''Set a metadata value.'''
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    # Songs
+
+    def countSongs(self):
+        '''Count the songs in the store.'''
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def hasSong(self, abbrev):
+        '''Check if a song is in the store.'''
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM songs WHERE abbrev = ?", (abbrev,)).fetchone()
+        return row is not None
+
+    def getSong(self, abbrev):
+        '''Get the features of a song, or None if it is not in the store.'''
+        with self.lock:
+            row = self.conn.execute("SELECT features FROM songs WHERE abbrev = ?", (abbrev,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def saveSong(self, abbrev, features):
+        '''Insert or update a song and remove it from the pending songs, atomically.'''
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO songs VALUES (?, ?) ON CONFLICT(abbrev) DO UPDATE SET features = excluded.features",
+                (abbrev, json.dumps(features)),
+            )
+            self.conn.execute("DELETE FROM pending WHERE abbrev = ?", (abbrev,))
+
+    def saveSongs(self, songs):
+        '''Insert or update many (abbrev, features) pairs in a single transaction.'''
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO songs VALUES (?, ?) ON CONFLICT(abbrev) DO UPDATE SET features = excluded.features",
+                [(abbrev, json.dumps(features)) for abbrev, features in songs],
+            )
+
+    def lastRowid(self):
+        '''Get the position of the most recently inserted song, 0 for an empty store.'''
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM songs").fetchone()[0]
+
+    def iterSongs(self, batch_size=500, after=0):
+        '''Yield (abbrev, features) for every song inserted after position "after", a batch at a time.'''
+        last = after
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, abbrev, features FROM songs WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, abbrev, features in rows:
+                yield abbrev, json.loads(features)
+            last = rows[-1][0]
+
+    # Pending songs
+
+    def addPending(self, billboard, updated_week=None):
+        '''
+        Record songs to be fetched, together with the week they bring the dataset up to.
+
+        Parameters:
+            billboard (list): Tuples of title and artist.
+            updated_week (str): The new value of "updated_week", set in the same transaction.
+        '''
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO pending VALUES (?, ?, ?)",
+                [(title.replace("_", " ") + "_" + artist.replace("_", " "), title, artist) for title, artist in billboard],
+            )
+            if updated_week is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('updated_week', ?)", (updated_week,))
+
+    def getPending(self):
+        '''Get the songs still to be fetched as tuples of title and artist.'''
+        with self.lock:
+            return [tuple(row) for row in self.conn.execute("SELECT title, artist FROM pending ORDER BY rowid")]
+
+    def dropPending(self, abbrev):
+        '''Remove a song that could not be fetched from the pending songs.'''
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM pending WHERE abbrev = ?", (abbrev,))
+
+    # Migration
+
+    def importJSON(self, path):
+        '''Import a cache.json written by earlier versions of data_fetch.py.'''
+        with open(path, "r") as file:
+            dataset = json.load(file)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO songs VALUES (?, ?)",
+                [(abbrev, json.dumps(features)) for abbrev, features in dataset.get("data", {}).items()],
+            )
+            if "updated_week" in dataset:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('updated_week', ?)", (dataset["updated_week"],))
+
+
+def openStore(path=STORE_FILENAME, legacy_path="cache.json"):
+    '''Open the song store, importing the legacy cache.json into a new store.'''
+    store = SongStore(path)
+    if store.countSongs() == 0 and store.getMeta("updated_week") is None and os.path.exists(legacy_path):
+        store.importJSON(legacy_path)
+    return store
@@ -0,0 +1,78 @@
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+
+# Packages the app should only import once a song has been picked
+DEFERRED_PACKAGES = [
+    "langchain",
+    "langchain_core",
+    "langchain_community",
+    "langchain_openai",
+    "openai",
+    "tiktoken",
+    "faiss",
+    "streamlit_js_eval",
+]
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_costs(module="app_function"):
+    """
+    Imports a module in a fresh interpreter with "-X importtime" and sums the
+    import time of every top-level package it loads.
+
+    Parameters:
+    - module (str): The module to import.
+
+    Returns:
+    - tuple: The total import time of the module in seconds, and a list of
+      (package, seconds, number of modules) sorted by cost.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    packages = defaultdict(lambda: [0, 0])
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        own, cumulative, indent, name = match.groups()
+        package = packages[name.split(".")[0]]
+        package[0] += int(own)
+        package[1] += 1
+        if name == module and len(indent) == 1:
+            total = int(cumulative)
+
+    costs = [(name, own / 1e6, count) for name, (own, count) in packages.items()]
+    costs.sort(key=lambda cost: cost[1], reverse=True)
+    return total / 1e6, costs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report what importing the app costs per package.")
+    parser.add_argument("module", nargs="?", default="app_function")
+    parser.add_argument("--top", type=int, default=20, help="number of packages to list")
+    parser.add_argument("--check", action="store_true", help="fail if a deferred package is imported")
+    args = parser.parse_args()
+
+    total, costs = import_costs(args.module)
+    print(f"import {args.module}: {total:.3f}s")
+    print(f"{'package':<30} {'seconds':>8} {'modules':>8}")
+    for name, seconds, count in costs[: args.top]:
+        print(f"{name:<30} {seconds:>8.3f} {count:>8}")
+
+    loaded = [name for name, _, _ in costs if name in DEFERRED_PACKAGES]
+    if loaded:
+        print(f"Loaded at import time although deferred: {', '.join(loaded)}")
+    if args.check and loaded:
+        sys.exit(1)
@@ -0,0 +1,64 @@
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class StubChatModel(BaseChatModel):
+    """
+    An offline stand-in for the chat model. It answers every question with a
+    deterministic text quoting the retrieved lyrics, waits like a real model
+    would, and streams the answer word by word when streaming is on. It is
+    meant for testing the chat pane without network access.
+
+    Parameters:
+    - first_token_delay (float): Seconds before the first token.
+    - token_delay (float): Seconds between tokens.
+    - streaming (bool): Whether to report every token to the callbacks.
+    """
+
+    model_name: str = "stub"
+    first_token_delay: float = 0.5
+    token_delay: float = 0.02
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat-model"
+
+    def get_num_tokens(self, text: str) -> int:
+        # Counts words, so token budgets work without downloading a tokenizer
+        return len(text.split())
+
+    def _respond(self, messages):
+        question = messages[-1].content.strip()
+        context = [
+            line.strip()
+            for message in messages[:-1]
+            for line in message.content.splitlines()
+            if line.strip()
+        ]
+        quote = " / ".join(context[-3:]) if context else "nothing"
+        return f'This is a stub answer to "{question}". The lyrics it was given end with: {quote}'
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = self._respond(messages)
+        tokens = re.findall(r"\s*\S+", text)
+
+        time.sleep(self.first_token_delay)
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(self.token_delay)
+            if self.streaming and run_manager is not None:
+                run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
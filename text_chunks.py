@@ -0,0 +1,27 @@
+import metrics
+
+
+# Lyrics are split on line breaks into chunks of up to this many characters,
+# overlapping so that a line near a boundary is retrieved with its context
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def get_text_chunks(text):
+    """
+    Splits the given text into chunks based on specified character settings.
+
+    Parameters:
+    - text (str): The text to be split into chunks.
+
+    Returns:
+    - list: A list of text chunks.
+    """
+    from langchain.text_splitter import CharacterTextSplitter
+
+    text_splitter = CharacterTextSplitter(
+        separator="\n", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len
+    )
+    with metrics.span("chat.split"):
+        chunks = text_splitter.split_text(text)
+    return chunks
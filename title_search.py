@@ -0,0 +1,195 @@
+import re
+import unicodedata
+
+import numpy as np
+
+
+# Version and featuring suffixes that are not part of the name of a song,
+# e.g. "(Taylor's Version)", "[Remix]", "- Remastered 2011" or "feat. Drake"
+SUFFIX_PATTERN = re.compile(r"\s*[(\[][^)\]]*[)\]]|\s+-\s+.*$|\s+(?:feat|ft|featuring)\b.*$")
+# Words joining the artists of a song
+ARTIST_JOINERS = re.compile(r"\b(?:featuring|feat|ft|with|x|and)\b|&")
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# How much the terms of a song that are not in the query count against it,
+# relative to the terms of the query that are not in the song
+EXTRA_WEIGHT = 0.25
+# The most postings read per query; the rarest terms of the query are read first
+CANDIDATE_BUDGET = 4096
+# The candidates scored against every term of the query
+RESCORED = 512
+# Matches scoring lower share little more than a letter or two with the query
+MIN_SCORE = 0.2
+
+
+def normalize(text, artist=False):
+    """
+    Normalizes a title or artist for matching: lowercase, without accents,
+    apostrophes, punctuation or version and featuring suffixes.
+
+    Parameters:
+    - text (str): The title or artist.
+    - artist (bool): Treat the text as artists, dropping the words that join
+      them rather than the featured artists.
+
+    Returns:
+    - str: Words separated by single spaces.
+    """
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text.replace("’", "'"))
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    text = text.lower().replace("'", "")
+    if artist:
+        text = ARTIST_JOINERS.sub(" ", text)
+    else:
+        # A title that is only a suffix, e.g. "(Intro)", is kept as it is
+        text = SUFFIX_PATTERN.sub("", text) or text
+    return NON_WORD.sub(" ", text).strip()
+
+
+def word_terms(word):
+    """
+    Returns the terms of one word: its character trigrams, padded with two
+    spaces before and one after so that short words and word starts have
+    trigrams of their own, and the whole word with a space on both sides.
+
+    Trigrams match misspelled words; whole words make correctly spelled
+    queries far more selective.
+
+    Parameters:
+    - word (str): A word of normalized text.
+
+    Returns:
+    - list: The terms.
+    """
+    padded = "  " + word + " "
+    return [padded[i : i + 3] for i in range(len(padded) - 2)] + [padded[1:]]
+
+
+def terms(text):
+    """
+    Returns the terms of normalized text, as in word_terms().
+
+    Parameters:
+    - text (str): The output of normalize().
+
+    Returns:
+    - set: The terms.
+    """
+    found = set()
+    for word in text.split():
+        found.update(word_terms(word))
+    return found
+
+
+class TitleSearch:
+    """
+    An index of the character trigrams and words of the title and artist of
+    every song, for finding a song by name despite typos and version suffixes.
+
+    Songs are ranked by how many terms they share with the query, penalized
+    by the terms the query misses and, less, by the ones the song adds. Only
+    the postings of the rarest terms of the query are read, and only the
+    songs sharing the most of them are ranked, so a search takes about the
+    same time on any size of catalogue.
+
+    Parameters:
+    - df (DataFrame): The songs, with id, title and artist columns. Only the
+      first row of each id is indexed.
+    """
+
+    def __init__(self, df):
+        first = np.flatnonzero(~df["id"].duplicated().to_numpy())
+        titles = df["title"].to_numpy()[first]
+        artists = df["artist"].to_numpy()[first]
+
+        # Words and artists repeat across a catalogue, so their term ids are worked out once
+        term_ids = {}
+        word_ids = {}
+        artist_ids = {}
+
+        def ids_of(text):
+            ids = set()
+            for word in text.split():
+                known = word_ids.get(word)
+                if known is None:
+                    known = word_ids[word] = [term_ids.setdefault(term, len(term_ids))
+                                              for term in word_terms(word)]
+                ids.update(known)
+            return ids
+
+        lengths = []
+        terms_flat = []
+        for title, artist in zip(titles, artists):
+            ids = artist_ids.get(artist)
+            if ids is None:
+                ids = artist_ids[artist] = ids_of(normalize(str(artist), artist=True))
+            ids = ids_of(normalize(str(title))) | ids
+            lengths.append(len(ids))
+            terms_flat.extend(ids)
+
+        lengths = np.array(lengths, dtype=np.int64)
+        terms_flat = np.array(terms_flat, dtype=np.int32)
+
+        self.rows = first
+        self.term_ids = term_ids
+        self.lengths = lengths.astype(np.int32)
+        # Forward index: the terms of each song
+        self.forward_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.forward_terms = terms_flat
+        # Inverted index: the songs of each term, in row order
+        keys = terms_flat.astype(np.int64) * len(first)
+        keys += np.repeat(np.arange(len(first), dtype=np.int64), lengths)
+        keys.sort()
+        self.postings_songs = (keys % max(len(first), 1)).astype(np.int32)
+        self.postings_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(terms_flat, minlength=len(term_ids)))]
+        ).astype(np.int64)
+
+    def search(self, query, k=10, min_score=MIN_SCORE):
+        """
+        Finds the songs whose title and artist best match a query.
+
+        Parameters:
+        - query (str): Part of a title, an artist, or both, possibly misspelled.
+        - k (int): The most songs to return.
+        - min_score (float): The lowest score of a match.
+
+        Returns:
+        - tuple: The row positions in df and the scores of the best matches,
+          best first. Scores are between 0 and 1, where 1 means the song has
+          every term of the query and no others.
+        """
+        query_terms = terms(normalize(query))
+        known = np.array([self.term_ids[term] for term in query_terms if term in self.term_ids], dtype=np.int64)
+        if len(known) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # Candidates: the songs sharing the most of the rarest terms of the
+        # query, reading postings up to the budget
+        starts, ends = self.postings_offsets[known], self.postings_offsets[known + 1]
+        order = np.argsort(ends - starts, kind="stable")
+        sizes = np.cumsum((ends - starts)[order])
+        used = order[: max(1, int(np.searchsorted(sizes, CANDIDATE_BUDGET, side="right")))]
+        candidates, counts = np.unique(np.concatenate(
+            [self.postings_songs[start : min(end, start + CANDIDATE_BUDGET)]
+             for start, end in zip(starts[used], ends[used])]
+        ), return_counts=True)
+        if len(candidates) > RESCORED:
+            candidates = np.sort(candidates[np.argpartition(-counts, RESCORED - 1)[:RESCORED]])
+
+        # All shared terms of each candidate, read from the forward index
+        in_query = np.zeros(len(self.term_ids), dtype=np.uint8)
+        in_query[known] = 1
+        lengths = self.lengths[candidates]
+        ends = np.cumsum(lengths)
+        firsts = ends - lengths
+        positions = np.arange(ends[-1]) + np.repeat(self.forward_offsets[candidates] - firsts, lengths)
+        shared = np.add.reduceat(in_query[self.forward_terms[positions]], firsts, dtype=np.int32)
+
+        scores = shared / (len(query_terms) + EXTRA_WEIGHT * (lengths - shared))
+        k = min(k, len(candidates))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((candidates[best], -scores[best]))]
+        best = best[scores[best] >= min_score]
+        return self.rows[candidates[best]], scores[best]
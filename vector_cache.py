@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+
+VECTOR_CACHE_DIR = "vector_cache"
+VECTOR_CACHE_SIZE = 64
+
+
+def cache_key(song_id, lyrics, model_name):
+    """
+    Builds the content address of a song's vector store.
+
+    Parameters:
+    - song_id (str): The Spotify ID of the song.
+    - lyrics (str): The lyrics the vector store is built from.
+    - model_name (str): The name of the embedding model.
+
+    Returns:
+    - str: A hex digest that changes whenever any of the inputs change.
+    """
+    lyrics_hash = hashlib.sha256(lyrics.encode("utf-8")).hexdigest()
+    key = "\0".join([song_id, lyrics_hash, model_name])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class VectorStoreCache:
+    """
+    A two-tier cache of FAISS vector stores: a bounded in-memory LRU in front of
+    a directory of saved indexes. Each store is built at most once per key, even
+    when several sessions ask for it at the same time.
+    """
+
+    def __init__(self, directory=VECTOR_CACHE_DIR, max_size=VECTOR_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, song_id, lyrics, model_name, embeddings, build):
+        """
+        Returns the vector store for a song, building it only on a full miss.
+
+        Parameters:
+        - song_id (str): The Spotify ID of the song.
+        - lyrics (str): The lyrics of the song.
+        - model_name (str): The name of the embedding model.
+        - embeddings (Embeddings): Used to embed queries against a store loaded from disk.
+        - build (callable): Called with no arguments to build the store on a miss.
+
+        Returns:
+        - FAISS: The vector store for the song.
+        """
+        key = cache_key(song_id, lyrics, model_name)
+        vectorstore = self._from_memory(key)
+        if vectorstore is not None:
+            metrics.increment("vector_cache.memory_hits")
+            return vectorstore
+
+        with self._lock_for(key):
+            vectorstore = self._from_memory(key)
+            if vectorstore is not None:
+                metrics.increment("vector_cache.memory_hits")
+            else:
+                vectorstore = self._from_disk(key, embeddings)
+                if vectorstore is not None:
+                    metrics.increment("vector_cache.disk_hits")
+            if vectorstore is None:
+                metrics.increment("vector_cache.misses")
+                vectorstore = build()
+                self._to_disk(key, vectorstore)
+            self._to_memory(key, vectorstore)
+        return vectorstore
+
+    def _lock_for(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _from_memory(self, key):
+        with self._lock:
+            vectorstore = self._memory.get(key)
+            if vectorstore is not None:
+                self._memory.move_to_end(key)
+            return vectorstore
+
+    def _to_memory(self, key, vectorstore):
+        with self._lock:
+            self._memory[key] = vectorstore
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                evicted, _ = self._memory.popitem(last=False)
+                self._key_locks.pop(evicted, None)
+
+    def _from_disk(self, key, embeddings):
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        from langchain_community.vectorstores import FAISS
+
+        # The directory only ever holds indexes this cache wrote itself
+        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+    def _to_disk(self, key, vectorstore):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        tmp_path = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            vectorstore.save_local(tmp_path)
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process saved the same key first
+            shutil.rmtree(tmp_path, ignore_errors=True)